@@ -0,0 +1,74 @@
+"""
+Run the benchmarks in `benchmarks.benchmarks` without asv.
+
+Usage: python -m benchmarks [-n SIZE [SIZE ...]] [-k PATTERN]
+"""
+import argparse
+import inspect
+import sys
+import time
+import warnings
+
+from benchmarks import benchmarks
+
+
+def run(sizes, pattern, repeat):
+    print('{:<40} {:>10} {:>12} {:>14}'.format('benchmark', 'entries', 'time (s)',
+                                               'entries/s'))
+    for class_name, cls in inspect.getmembers(benchmarks, inspect.isclass):
+        if class_name.startswith('_') or cls.__module__ != benchmarks.__name__:
+            continue
+        for method_name in sorted(dir(cls)):
+            if not method_name.startswith(('time_', 'track_')):
+                continue
+            name = '{}.{}'.format(class_name, method_name)
+            if pattern is not None and pattern not in name:
+                continue
+            # Only use the sizes that the benchmark supports
+            class_sizes = [n for n in sizes if n in cls.params] or cls.params[:1]
+            for n_entries in class_sizes:
+                bench = cls()
+                bench.setup(n_entries)
+                try:
+                    times = []
+                    for i in range(repeat):
+                        start = time.perf_counter()
+                        value = getattr(bench, method_name)(n_entries)
+                        times.append(time.perf_counter() - start)
+                finally:
+                    if hasattr(bench, 'teardown'):
+                        bench.teardown(n_entries)
+                if method_name.startswith('track_'):
+                    # Tracking benchmarks return the value to report
+                    # instead of being timed.
+                    unit = getattr(getattr(cls, method_name), 'unit', '')
+                    print('{:<40} {:>10} {:>12.0f} {}'.format(name, n_entries, value, unit))
+                else:
+                    best = min(times)
+                    print('{:<40} {:>10} {:>12.4f} {:>14.0f}'.format(name, n_entries, best,
+                                                                     n_entries / best))
+                sys.stdout.flush()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument(
+        '-n', '--sizes', nargs='+', type=int, default=[1000, 10000],
+        help='Numbers of entries in the synthetic bibliographies.',
+        )
+    arg_parser.add_argument(
+        '-k', '--pattern',
+        help='Only run the benchmarks whose name contains this string.',
+        )
+    arg_parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='Number of times each benchmark is run. The best time is reported.',
+        )
+    args = arg_parser.parse_args(argv)
+    # The synthetic authors are not highlighted in every reference.
+    warnings.simplefilter('ignore')
+    run(args.sizes, args.pattern, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
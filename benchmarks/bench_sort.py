@@ -0,0 +1,41 @@
+"""
+Compare the time to sort references with the old two-pass sort and
+with `sort_references`.
+
+Run with `python -m benchmarks.bench_sort` from the root of the
+repository.
+"""
+from datetime import datetime
+import timeit
+
+from bibtextomd.bib import sort_references
+from benchmarks.synthetic import make_refsdict
+
+
+def two_pass_sort(refsdict):
+    """The sort used by `load_bibtex` up to v0.4.2."""
+    entry_types = set(ref["ENTRYTYPE"] for ref in refsdict.values())
+    sort_dict = {}
+    for t in entry_types:
+        temp = sorted([val for key, val in refsdict.items()
+                      if val["ENTRYTYPE"] == t], key=lambda l:
+                      datetime.strptime(l["month"], '%b').month, reverse=True)
+        sort_dict[t] = sorted(temp, key=lambda k: k["year"], reverse=True)
+    return sort_dict
+
+
+def main():
+    print('{:>10} {:>14} {:>14} {:>8}'.format('entries', 'two-pass (s)', 'single (s)',
+                                              'speedup'))
+    for n_entries in (1000, 10000, 100000, 1000000):
+        refsdict = make_refsdict(n_entries)
+        # Fewer repeats for the bigger bibliographies, the old sort
+        # takes a long time there.
+        number = max(1, 10000 // n_entries)
+        old = timeit.timeit(lambda: two_pass_sort(refsdict), number=number) / number
+        new = timeit.timeit(lambda: sort_references(refsdict), number=number) / number
+        print('{:>10} {:>14.4f} {:>14.4f} {:>7.1f}x'.format(n_entries, old, new, old/new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmarks of the conversion pipeline, in the style of asv
+
+Each class times one stage of the pipeline for synthetic
+bibliographies of different sizes. Run them with `asv run`, or without
+asv with `python -m benchmarks`.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from bibtextomd.bib import (main, load_bibtex, reorder, format_reference, sort_references,
+                            tidy_name, FORMATTERS)
+from benchmarks.synthetic import write_bibtex, make_refsdict
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+# Target time in seconds to start the command line tool when there is
+# nothing to do.
+COLD_START_BUDGET = 0.1
+
+
+class _BibFile(object):
+    """Write a synthetic BibTeX file with `n_entries` references in `setup`."""
+    params = SIZES
+    param_names = ['n_entries']
+    timeout = 3600
+
+    def setup(self, n_entries):
+        self.directory = tempfile.mkdtemp()
+        self.bib_file_name = os.path.join(self.directory, 'refs.bib')
+        self.output_file_name = os.path.join(self.directory, 'pubs.md')
+        write_bibtex(self.bib_file_name, n_entries)
+
+    def teardown(self, n_entries):
+        shutil.rmtree(self.directory)
+
+
+class Parse(_BibFile):
+    def time_load_bibtex(self, n_entries):
+        load_bibtex(self.bib_file_name)
+
+    def time_load_bibtex_fast(self, n_entries):
+        load_bibtex(self.bib_file_name, parser='fast')
+
+    def time_load_bibtex_parallel(self, n_entries):
+        load_bibtex(self.bib_file_name, parser='fast', jobs=os.cpu_count() or 1)
+
+
+class Memory(_BibFile):
+    """Measure the memory used by the loaded references."""
+
+    def peakmem_load_bibtex(self, n_entries):
+        load_bibtex(self.bib_file_name, parser='fast')
+
+    def track_bytes_per_entry(self, n_entries):
+        # Load once first so that the memory of the imported modules
+        # and the memoized names is not counted.
+        load_bibtex(self.bib_file_name, parser='fast')
+        tracemalloc.start()
+        try:
+            sort_dict = load_bibtex(self.bib_file_name, parser='fast')
+            current = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del sort_dict
+        return current / n_entries
+    track_bytes_per_entry.unit = 'bytes'
+
+
+class Sort(object):
+    params = SIZES
+    param_names = ['n_entries']
+
+    def setup(self, n_entries):
+        self.refsdict = make_refsdict(n_entries)
+
+    def time_sort_references(self, n_entries):
+        sort_references(self.refsdict)
+
+
+class _Parsed(_BibFile):
+    """Parse the synthetic BibTeX file in `setup`."""
+
+    def setup(self, n_entries):
+        super(_Parsed, self).setup(n_entries)
+        sort_dict = load_bibtex(self.bib_file_name)
+        self.refs = [ref for t in sort_dict if t in FORMATTERS for ref in sort_dict[t]]
+
+
+class Authors(_Parsed):
+    def time_reorder(self, n_entries):
+        # Clear the memo of names so every run does the same work.
+        tidy_name.cache_clear()
+        for ref in self.refs:
+            reorder(ref["author"], 'F.A. Author')
+
+
+class Render(_Parsed):
+    def time_format_reference(self, n_entries):
+        for ref in self.refs:
+            format_reference(ref, None)
+
+
+class EndToEnd(_BibFile):
+    def time_main(self, n_entries):
+        main(['-b', self.bib_file_name, '-o', self.output_file_name, '--no-cache'])
+
+
+class ColdStart(_BibFile):
+    """Time starting the command line tool in a new process.
+
+    The goal is to stay under `COLD_START_BUDGET` seconds for `--help`
+    and for a run where the BibTeX file has not changed.
+    """
+    params = [1000]
+
+    def setup(self, n_entries):
+        super(ColdStart, self).setup(n_entries)
+        self.args = ['-b', self.bib_file_name, '-o', self.output_file_name]
+        main(self.args)
+
+    def time_help(self, n_entries):
+        subprocess.check_call([sys.executable, '-m', 'bibtextomd', '--help'],
+                              stdout=subprocess.DEVNULL)
+
+    def time_unchanged(self, n_entries):
+        subprocess.check_call([sys.executable, '-m', 'bibtextomd'] + self.args)
+
+    def timeraw_import(self, n_entries):
+        return "import bibtextomd.__main__"
@@ -0,0 +1,130 @@
+"""
+Load test the server of `bibtextomd --serve` on localhost.
+
+Usage: python -m benchmarks.load_test [-n ENTRIES] [-c CONNECTIONS] [-r REQUESTS]
+
+Starts the server on a synthetic bibliography, sends requests for the
+pages of a few authors over keep-alive connections, and prints the
+requests per second and the latency percentiles.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+from benchmarks.synthetic import write_bibtex
+
+AUTHORS = ['F.A. Author', 'S.B. Second', 'T.C. Third', 'B.W. Weber', None]
+
+
+def free_port():
+    """Return a port on localhost that nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=600):
+    """Block until the server accepts connections."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def client(port, targets, latencies):
+    """Send the requests for `targets` one after another on one connection."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for target in targets:
+        start = time.perf_counter()
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(target).encode())
+        status = await reader.readline()
+        if not status.startswith(b'HTTP/1.1 200'):
+            raise RuntimeError('{} returned {}'.format(target, status.decode().strip()))
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+def run(port, connections, requests):
+    """Send `requests` requests over `connections` connections and return the latencies."""
+    targets = []
+    for i in range(requests):
+        author = AUTHORS[i % len(AUTHORS)]
+        targets.append('/refs' if author is None else '/refs?author=' + quote(author))
+
+    latencies = []
+
+    async def clients():
+        await asyncio.gather(*[client(port, targets[i::connections], latencies)
+                               for i in range(connections)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(clients())
+    finally:
+        loop.close()
+    return latencies
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument(
+        '-n', '--entries', type=int, default=10000,
+        help='Number of entries in the synthetic bibliography.',
+        )
+    arg_parser.add_argument(
+        '-c', '--connections', type=int, default=10,
+        help='Number of concurrent connections.',
+        )
+    arg_parser.add_argument(
+        '-r', '--requests', type=int, default=1000,
+        help='Total number of requests.',
+        )
+    args = arg_parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    bib_file_name = os.path.join(directory, 'refs.bib')
+    write_bibtex(bib_file_name, args.entries)
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'bibtextomd', '--serve', '--parser',
+                               'fast', '-b', bib_file_name, '--port', str(port)])
+    try:
+        wait_for_server(port)
+        start = time.perf_counter()
+        latencies = run(port, args.connections, args.requests)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+    latencies.sort()
+    print('{} requests over {} connections in {:.3f} s: {:.0f} requests/s'.format(
+        len(latencies), args.connections, elapsed, len(latencies) / elapsed))
+    for percentile in (50, 90, 99):
+        index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+        print('p{}: {:.2f} ms'.format(percentile, latencies[index] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Deterministic synthetic bibliographies for the benchmarks
+"""
+import random
+
+ENTRY_TYPES = ['article', 'article', 'article', 'inproceedings', 'inproceedings',
+               'phdthesis', 'mastersthesis']
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct',
+          'nov', 'dec']
+
+# Last names, with some LaTeX escapes and some unicode, as Mendeley and
+# Zotero export them.
+LAST_NAMES = [
+    'Smith', 'Jones', 'Author', 'Second', 'Third', 'Weber', 'Sung', 'Nguyen', 'Kim',
+    'M\\"{u}ller', 'S\\\'{e}cond', 'Garc\\\'{\\i}a', 'Fran\\c{c}ois', '{\\O}ster',
+    'Ng{\\~{u}}yen', 'Østergaard', 'Šimek', 'Nuñez', '{van der Berg}', '{Fourth-Fifth}',
+]
+FIRST_NAMES = [
+    'First A.', 'Second B.', 'Third C.', 'Bryan W.', 'Chih-Jen', 'Jean-Luc', 'Anna',
+    'J\\"{o}rg', 'Ren\\\'{e}', 'Zoë', 'Ferdinand J.', 'Mary Ann',
+]
+# Most papers have a handful of authors, a few have many.
+AUTHOR_COUNTS = [1, 2, 2, 3, 3, 3, 4, 4, 4, 5, 5, 6, 7, 8, 12, 25]
+JOURNALS = [
+    'Journal of Made Up Names', 'Energy \\\\& Fuels', 'Combustion and Flame',
+    'Proceedings of the Combustion Institute', 'Journal of Physical Chemistry A',
+]
+WORDS = [
+    'study', 'ignition', 'name', 'made', 'up', 'rapid', 'compression', 'machine',
+    'kinetics', 'model', 'reduced', 'mechanism', 'of', 'the', 'a', 'for', 'with',
+    'n-butanol', 'H$_2$O', '{DNA}', 'na\\"{i}ve', 'caf\\\'{e}',
+]
+
+
+def _title(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for i in range(n_words)).capitalize()
+
+
+def _authors(rng):
+    n_authors = rng.choice(AUTHOR_COUNTS)
+    return ' and '.join('{}, {}'.format(rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES))
+                        for i in range(n_authors))
+
+
+def make_entry(rng, key):
+    """Return the fields of one random reference as a list of (field, value)."""
+    entrytype = rng.choice(ENTRY_TYPES)
+    fields = [
+        ('author', '{' + _authors(rng) + '}'),
+        ('title', '{{' + _title(rng, rng.randint(4, 14)) + '}}'),
+        ('month', rng.choice(MONTHS)),
+        ('year', '{' + str(rng.randint(1980, 2016)) + '}'),
+    ]
+    if entrytype == 'article':
+        fields.append(('journal', '{' + rng.choice(JOURNALS) + '}'))
+        if rng.random() < 0.8:
+            fields.append(('volume', '{' + str(rng.randint(1, 200)) + '}'))
+            fields.append(('number', '{' + str(rng.randint(1, 12)) + '}'))
+            first_page = rng.randint(1, 5000)
+            fields.append(('pages', '{{{}--{}}}'.format(first_page,
+                                                        first_page + rng.randint(5, 30))))
+    elif entrytype == 'inproceedings':
+        fields.append(('booktitle', '{' + _title(rng, 5) + ' Conference}'))
+        fields.append(('pages', '{{Paper {}}}'.format(rng.randint(1, 999))))
+        fields.append(('organization', '{University}'))
+        fields.append(('address', '{Anytown, CA}'))
+    else:
+        fields.append(('school', '{University}'))
+    if rng.random() < 0.7:
+        fields.append(('doi', '{{10.{}/{}}}'.format(rng.randint(1000, 9999), key.lower())))
+    if rng.random() < 0.2:
+        fields.append(('annote', '{The files can be found at the following link}'))
+    # Mendeley exports long abstracts and other fields that are never
+    # formatted.
+    if rng.random() < 0.5:
+        fields.append(('abstract', '{' + _title(rng, rng.randint(100, 250)) + '}'))
+    if rng.random() < 0.5:
+        fields.append(('keywords', '{' + ','.join(rng.sample(WORDS, 4)) + '}'))
+    return entrytype, fields
+
+
+def make_bibtex(n_entries, seed=0):
+    """Yield the lines of a BibTeX file with `n_entries` references."""
+    rng = random.Random(seed)
+    for i in range(n_entries):
+        key = 'Ref{}'.format(i)
+        entrytype, fields = make_entry(rng, key)
+        yield '@{}{{{},\n'.format(entrytype, key)
+        for field, value in fields:
+            yield '{} = {},\n'.format(field, value)
+        yield '}\n'
+
+
+def write_bibtex(file_name, n_entries, seed=0):
+    """Write a BibTeX file with `n_entries` references to `file_name`."""
+    with open(file_name, 'w', encoding='utf-8') as bib_file:
+        bib_file.writelines(make_bibtex(n_entries, seed))
+
+
+def make_refsdict(n_entries, seed=0):
+    """Return a dictionary of `n_entries` parsed references.
+
+    Only the fields needed to sort the references are filled in, so
+    this is suitable to benchmark `sort_references` without parsing.
+    """
+    rng = random.Random(seed)
+    refsdict = {}
+    for i in range(n_entries):
+        key = 'Ref{}'.format(i)
+        refsdict[key] = {
+            'ID': key,
+            'ENTRYTYPE': rng.choice(ENTRY_TYPES),
+            'year': str(rng.randint(1980, 2016)),
+            'month': rng.choice(MONTHS),
+        }
+    return refsdict
@@ -1,12 +1,26 @@
 #! /usr/bin/python3
 # System imports
-from datetime import datetime
-import argparse
+from collections import namedtuple
+from collections.abc import Mapping
+from functools import lru_cache, partial
+from heapq import heappush, heapreplace, nlargest
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
+import json
+import os
+import re
+import sys
 import warnings
 
-# Package imports
-from bibtexparser.bparser import BibTexParser
-from bibtexparser.customization import convert_to_unicode
+# `bibtexparser`, `argparse`, `multiprocessing`, and the profiler are
+# imported in the functions that need them, so that the command line
+# starts quickly when nothing has to be parsed or formatted.
+
+# Local imports
+from bibtextomd.cache import (RenderCache, DEFAULT_MAX_ENTRIES, cache_file_name,
+                              entry_key, output_digest, source_digest)
+from bibtextomd.stats import Stats, timed_iter
 
 # Set the formatting identifiers. Since we're using kramdown, we
 # don't have to use the HTML tags.
@@ -18,8 +32,90 @@ open_span = '<span>'
 close_span = '</span>'
 
 
+# Regular expression to split a list of names at each "and".
+AND_RE = re.compile(r'(?:^|\s)and(?=\s|$)')
+
+# Maximum number of distinct names whose formatting is memoized.
+NAME_CACHE_SIZE = 4096
+
+
 # First is to define a function to format the names we get from BibTeX,
 # since this task will be the same for every paper type.
+def tidy_names(names):
+    """Initialize the first names of a string of author names.
+
+    INPUT:
+    names -- string of names to be formatted, in the style "Last,
+             First Middle and Last, First Middle"
+    OUTPUT:
+    tidynames -- list of the formatted names, in the style "F.M. Last"
+
+    """
+    # Convert the input string to a list by splitting the string at
+    # each "and" that is a word on its own, so names containing "and",
+    # like "Brandywine", are not split. Then strip out any remaining
+    # whitespace and skip any blank names.
+    tidynames = []
+    for namestring in AND_RE.split(names):
+        namestring = namestring.strip()
+        if namestring:
+            tidynames.append(tidy_name(namestring))
+
+    return tidynames
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def tidy_name(namestring):
+    """Initialize the first names of a single author name.
+
+    The same authors show up on many references, so the formatted
+    names are memoized. Use `tidy_name.cache_info()` to see how often
+    the memo is hit.
+    INPUT:
+    namestring -- string of the name, in the style "Last, First Middle"
+    OUTPUT:
+    string of the formatted name, in the style "F.M. Last"
+
+    """
+    # Split the `namestring` at the comma, but only perform the
+    # split once.
+    namesplit = namestring.rsplit(',', 1)
+
+    # In the expected format, the first element of the split
+    # namestring is the last name. Strip any whitespace and {}.
+    last = namesplit[0].strip().strip('{}')
+
+    # There could be many first/middle names, so we collect them in
+    # a list. All of the first/middle names are stored in the
+    # second element of namesplit seperated by whitespace. Split
+    # the first/middle names at the whitespace then strip out any
+    # remaining whitespace and any periods (the periods will be
+    # added in the proper place later).
+    firsts = [i.strip().strip('.') for i in namesplit[1].split()]
+
+    # For the case of hyphenated first names, we need to split at
+    # the hyphen as well. Possible bug: this only works if the
+    # first first name is the hyphenated one, and this replaces all
+    # of the first names with the names split at the hyphen. We'd
+    # like to handle multiple hyphens or a hyphenated name with an
+    # initial more intelligently.
+    if '-' in firsts[0]:
+        firsts = firsts[0].split('-')
+
+    # Now that all the first name edge cases are sorted out, we
+    # want to initialize all the first names. Set the variable
+    # initials to an empty string to we can add to it. Then loop
+    # through each of the items in the list of first names. Take
+    # the first element of each item and append a period, but no
+    # space.
+    initials = ''
+    for item in firsts:
+        initials += item[0] + '.'
+
+    # Stick all of the parts of the name together
+    return initials + ' ' + last
+
+
 def reorder(names, faname):
     """Format the string of author names and return a string.
 
@@ -41,60 +137,7 @@ def reorder(names, faname):
     # the author list the website owner is. Default is **
     my_name_format_tag = '**'
 
-    # Convert the input string to a list by splitting the string at the
-    # "and " and strip out any remaining whitespace.
-    nameslist = [i.strip() for i in names.replace('\n', ' ').split("and ")]
-
-    # Initialize a list to store the names after they've been tidied
-    # up.
-    tidynames = []
-
-    # Loop through each name in the list.
-    for namestring in nameslist:
-        # Strip whitespace from the string
-        namestring = namestring.strip()
-
-        # If, for some reason, we've gotten a blank name, skip it
-        if len(namestring) < 1:
-            continue
-
-        # Split the `namestring` at the comma, but only perform the
-        # split once.
-        namesplit = namestring.rsplit(',', 1)
-
-        # In the expected format, the first element of the split
-        # namestring is the last name. Strip any whitespace and {}.
-        last = namesplit[0].strip().strip('{}')
-
-        # There could be many first/middle names, so we collect them in
-        # a list. All of the first/middle names are stored in the
-        # second element of namesplit seperated by whitespace. Split
-        # the first/middle names at the whitespace then strip out any
-        # remaining whitespace and any periods (the periods will be
-        # added in the proper place later).
-        firsts = [i.strip().strip('.') for i in namesplit[1].split()]
-
-        # For the case of hyphenated first names, we need to split at
-        # the hyphen as well. Possible bug: this only works if the
-        # first first name is the hyphenated one, and this replaces all
-        # of the first names with the names split at the hyphen. We'd
-        # like to handle multiple hyphens or a hyphenated name with an
-        # initial more intelligently.
-        if '-' in firsts[0]:
-            firsts = firsts[0].split('-')
-
-        # Now that all the first name edge cases are sorted out, we
-        # want to initialize all the first names. Set the variable
-        # initials to an empty string to we can add to it. Then loop
-        # through each of the items in the list of first names. Take
-        # the first element of each item and append a period, but no
-        # space.
-        initials = ''
-        for item in firsts:
-            initials += item[0] + '.'
-
-        # Stick all of the parts of the name together in `tidynames`
-        tidynames.append(initials + ' ' + last)
+    tidynames = tidy_names(names)
 
     # Find the case of the website author and set the format for that
     # name
@@ -123,214 +166,1945 @@ def reorder(names, faname):
     return nameout
 
 
-def journal_article(ref, faname):
-    # Get the string of author names in the proper format from
-    # the `reorder` function. Get some other information. Hack
-    # the journal title to remove the '\' before '&' in
-    # 'Energy & Fuels' because Mendeley inserts an extra '\'
-    # into the BibTeX.
-    authors = reorder(ref["author"], faname)
-    title = ref["title"]
+# Each type of reference is formatted from a template, which is a list
+# of lines. Each line is a tuple of the CSS class of the line and a
+# list of `Segment`s. The segments of a line that are present in the
+# reference are joined with commas and the line is surrounded by a
+# span. The {:.XYZ} is the kramdown notation to add that class to the
+# HTML tag. Each line is ended with two spaces before the newline so
+# that kramdown inserts an HTML <br> there. Lines without any segments
+# present in the reference are skipped.
+#
+# `field` is the name of the BibTeX field of the segment, or one of the
+# names in `FIELD_GETTERS`. `template` is formatted with the value of
+# the field as `value` and the formatting identifiers `em` and
+# `strong`. If a `required` field is missing, a KeyError is raised;
+# other fields are just left out.
+Segment = namedtuple('Segment', ['field', 'template', 'required'])
+Segment.__new__.__defaults__ = ('{value}', False)
+
+
+def _authors(ref, faname):
+    # Get the string of author names in the proper format from the
+    # `reorder` function.
+    return reorder(ref["author"], faname)
+
+
+def _journal(ref, faname):
+    # Hack the journal title to remove the '\' before '&' in 'Energy &
+    # Fuels' because Mendeley inserts an extra '\' into the BibTeX.
     journal = ref["journal"]
-    if '\&' in journal:
-        words = journal.strip().split('\&')
+    if '\\&' in journal:
+        words = journal.strip().split('\\&')
         journal = words[0] + '&' + words[1]
+    return journal
 
-    # Start building the string containing the formatted
-    # reference. Each bit should be surrounded by a span. The
-    # {:.XYZ} is the kramdown notation to add that class to the
-    # HTML tag. Each line should be ended with two spaces
-    # before the newline so that kramdown inserts an HTML <br>
-    # there.
-    reference = (
-        '\n{{:.paper}}\n{open}{title}{close}{{:.papertitle}}  \n'
-        '{open}{authors}{close}{{:.authors}}  \n'
-        '{open}{em}{journal}{em}, '.format(
-            open=open_span, close=close_span, title=title, authors=authors, em=em,
-            journal=journal,
-            )
-        )
 
-    # Not all journal articles will have vol., no., and pp.
-    # because some may be "In Press".
-    if "volume" in ref:
-        reference += 'vol. ' + ref["volume"] + ', '
+def _annote(ref, faname):
+    # Extra comments, such as links to files, should be stored as
+    # "Notes" for each reference in Mendeley. Mendeley will export this
+    # field with the tag "annote" in BibTeX.
+    return ref["annote"].replace('\\', '')
 
-    if "number" in ref:
-        reference += 'no. ' + ref["number"] + ', '
 
-    if "pages" in ref:
-        reference += 'pp. ' + ref["pages"] + ', '
+def _date(ref, faname):
+    # The month is abbreviated with a period, except for May, which is
+    # short enough already. Some references only have a year.
+    year = ref["year"]
+    if "month" not in ref:
+        return year
 
     month = ref["month"].title()
-    year = ref["year"]
     if month == "May":
         month += ' '
     else:
         month += '. '
+    return month + year
+
+
+# Functions to get the value of the fields that need more than just
+# looking up the field in the reference.
+FIELD_GETTERS = {
+    "author": _authors,
+    "journal": _journal,
+    "annote": _annote,
+    "date": _date,
+}
+
+DOI = ('doi', [
+    Segment('doi', '{strong}DOI:{strong} [{value}](https://dx.doi.org/{value})'),
+])
+COMMENT = ('comment', [Segment('annote')])
+
+ARTICLE_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author', required=True)]),
+    # Not all journal articles will have vol., no., and pp. because
+    # some may be "In Press".
+    ('journal', [
+        Segment('journal', '{em}{value}{em}', required=True),
+        Segment('volume', 'vol. {value}'),
+        Segment('number', 'no. {value}'),
+        Segment('pages', 'pp. {value}'),
+        Segment('date', required=True),
+    ]),
+    DOI,
+    COMMENT,
+]
+
+INPROCEEDINGS_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author', required=True)]),
+    # Since Mendeley doesn't allow customization of BibTeX output, we
+    # hack the "pages" field to contain the paper number for the
+    # conference paper. The conference title is stored in the
+    # "booktitle" field.
+    ('journal', [
+        Segment('pages'),
+        Segment('booktitle', required=True),
+        Segment('organization'),
+        Segment('address'),
+        Segment('date', required=True),
+    ]),
+    DOI,
+    COMMENT,
+]
+
+THESIS_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author', required=True)]),
+    ('journal', [Segment('school'), Segment('date', required=True)]),
+    COMMENT,
+]
+
+BOOK_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author', required=True)]),
+    ('journal', [
+        Segment('publisher'),
+        Segment('address'),
+        Segment('date', required=True),
+    ]),
+    DOI,
+    COMMENT,
+]
+
+TECHREPORT_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author', required=True)]),
+    ('journal', [
+        Segment('institution'),
+        Segment('number', 'Report No. {value}'),
+        Segment('date', required=True),
+    ]),
+    DOI,
+    COMMENT,
+]
+
+MISC_TEMPLATE = [
+    ('papertitle', [Segment('title', required=True)]),
+    ('authors', [Segment('author')]),
+    ('journal', [Segment('howpublished'), Segment('date', required=True)]),
+    DOI,
+    COMMENT,
+]
+
+
+# Each output format is described by the markup it puts around the
+# parts of the references and the headings. The templates are written
+# in kramdown, and are translated to the other formats when they are
+# compiled: `em` and `strong` are the (opening, closing) tags of the
+# formatting identifiers, `link` replaces the markdown links, and
+# `escape` is applied to every value. `paper` is the (start, end) of
+# each reference, and `line` is the (start, end) of each line, with the
+# CSS class of the line as `css_class`. `section`, `year`, `index_group`
+# and `index_item` are the templates of the headings of the sections
+# and the years and of the index of the shards, and `separator` goes
+# between the sections.
+OutputFormat = namedtuple('OutputFormat', [
+    'name', 'extension', 'em', 'strong', 'link', 'escape', 'paper', 'line', 'section',
+    'year', 'separator', 'index_group', 'index_item'])
+
+# Markdown links in the templates
+LINK_RE = re.compile(r'\[([^\]]*)\]\(([^)]*)\)')
+
+# Text between the tags that highlight an author
+HIGHLIGHT_RE = re.compile(r'\*\*(.+?)\*\*')
+
+
+def _escape_html(value):
+    # Escape the value for HTML, and turn the highlighting of the
+    # author from `reorder` into a tag.
+    import html
+    return HIGHLIGHT_RE.sub(r'<strong>\1</strong>', html.escape(value))
+
+
+KRAMDOWN = OutputFormat(
+    name='kramdown', extension='.md', em=(em, em), strong=(strong, strong),
+    link='[{text}]({url})', escape=None, paper=('\n{:.paper}\n', ''),
+    line=(open_span, close_span + '{{:.{css_class}}}  \n'), section='{heading}\n---\n',
+    year='\n{{:.year}}\n### {year}\n', separator='\n', index_group='{group}\n---\n\n',
+    index_item='- [{title}]({link})\n')
+
+# Plain markdown has no classes. Lines still end with two spaces so
+# that they are broken.
+MARKDOWN = KRAMDOWN._replace(
+    name='markdown', extension='.markdown', paper=('\n', ''), line=('', '  \n'),
+    year='\n### {year}\n')
+
+HTML = OutputFormat(
+    name='html', extension='.html', em=('<em>', '</em>'), strong=('<strong>', '</strong>'),
+    link='<a href="{url}">{text}</a>', escape=_escape_html,
+    paper=('<div class="paper">\n', '</div>\n'),
+    line=('<span class="{css_class}">', '</span><br>\n'), section='<h2>{heading}</h2>\n',
+    year='<h3 class="year">{year}</h3>\n', separator='\n', index_group='<h2>{group}</h2>\n',
+    index_item='<p><a href="{link}">{title}</a></p>\n')
+
+# JSON Lines has one JSON object for each reference and no headings.
+# It does not use templates.
+JSONL = OutputFormat(
+    name='jsonl', extension='.jsonl', em=None, strong=None, link=None, escape=None,
+    paper=None, line=None, section=None, year=None, separator='', index_group=None,
+    index_item=None)
+
+# Map the name of each output format to its `OutputFormat`.
+OUTPUT_FORMATS = dict((f.name, f) for f in (KRAMDOWN, MARKDOWN, HTML, JSONL))
+
+
+def _translate(template, output_format):
+    """Translate the kramdown markup of a segment template to `output_format`."""
+    def link(match):
+        return output_format.link.format(text=match.group(1), url=match.group(2))
+    template = LINK_RE.sub(link, template)
+
+    # The formatting identifiers come in pairs, so every other one is
+    # the opening tag.
+    for name in ('em', 'strong'):
+        tags = getattr(output_format, name)
+        pieces = template.split('{' + name + '}')
+        template = pieces[0] + ''.join(tags[i % 2] + piece
+                                       for i, piece in enumerate(pieces[1:]))
+    return template
+
+
+def _compile_segment(segment, output_format=KRAMDOWN):
+    """Return a function that formats one segment of a reference."""
+    field = segment.field
+    required = segment.required
+    escape = output_format.escape
+    get_value = FIELD_GETTERS.get(segment.field)
+    if get_value is None:
+        def get_value(ref, faname):
+            return ref[field]
+
+    # Fill in the formatting identifiers once, leaving only the value
+    # to be formatted for each reference.
+    format_value = _translate(segment.template, output_format).format(value='{value}').format
+
+    if escape is None:
+        def render_segment(ref, faname):
+            if required or field in ref:
+                return format_value(value=get_value(ref, faname))
+            return None
+    else:
+        def render_segment(ref, faname):
+            if required or field in ref:
+                return format_value(value=escape(get_value(ref, faname)))
+            return None
 
-    reference += (
-        '{month}{year}{close}{{:.journal}}  \n'.format(
-            month=month, year=year, close=close_span,
-            )
-        )
+    return render_segment
 
-    if "doi" in ref:
-        reference += (
-            '{open}{strong}DOI:{strong} [{doi}]'
-            '(https://dx.doi.org/{doi}){close}{{:.doi}}  \n'.format(
-                open=open_span, close=close_span, strong=strong,
-                doi=ref["doi"],
-                )
-            )
-
-    # Extra comments, such as links to files, should be stored
-    # as "Notes" for each reference in Mendeley. Mendeley will
-    # export this field with the tag "annote" in BibTeX.
-    if "annote" in ref:
-        reference += (
-            '{open}{annote}{close}{{:.comment}}  \n'.format(
-                open=open_span, close=close_span,
-                annote=ref["annote"].replace('\\', ''),
-                )
-            )
+
+def compile_template(template, output_format=KRAMDOWN):
+    """Compile a template into a function that formats a reference.
+
+    INPUT:
+    template -- list of (CSS class, list of `Segment`) tuples, one for
+                each line of the formatted reference
+    output_format -- the `OutputFormat` to format the reference in
+    OUTPUT:
+    render -- function with the arguments (ref, faname) that returns
+              the formatted string of the reference `ref`, with the
+              name `faname` highlighted in the author list
+
+    """
+    start, end = output_format.paper
+    lines = []
+    for css_class, segments in template:
+        line_start, line_end = (part.format(css_class=css_class)
+                                for part in output_format.line)
+        lines.append((line_start, line_end,
+                      [_compile_segment(segment, output_format) for segment in segments]))
+
+    def render(ref, faname):
+        reference = [start]
+        for line_start, line_end, segments in lines:
+            parts = [part for part in (segment(ref, faname) for segment in segments)
+                     if part is not None]
+            if parts:
+                reference.extend((line_start, ', '.join(parts), line_end))
+        reference.append(end)
+        return ''.join(reference)
+
+    return render
+
+
+def json_line(ref, faname):
+    """Format a reference as one line of JSON for the `jsonl` output format.
+
+    The object has all the fields of the reference, converted to
+    unicode, and the list of the initialized names of the authors as
+    `authors`.
+    """
+    fields = dict(ref)
+    if "author" in ref:
+        fields["authors"] = tidy_names(ref["author"])
+    return json.dumps(fields, ensure_ascii=False) + '\n'
+
+
+# Map each type of reference to the compiled function that formats it
+# in kramdown.
+FORMATTERS = {}
+
+# Map each type of reference to its template, and each (output format,
+# type of reference) to the compiled function that formats it in the
+# other output formats. These are compiled when they are first used.
+TEMPLATES = {}
+_COMPILED = {}
+_REQUIRED_FIELDS = {}
+
+# List of (type of reference, heading) tuples of the sections of the
+# output, in order. Types of reference without a heading are formatted,
+# but not written in the output.
+SECTIONS = []
+
+
+def register_entry_type(entrytype, template, heading=None):
+    """Add a type of reference that can be formatted.
+
+    INPUT:
+    entrytype -- the BibTeX type of the reference, such as `article`
+    template -- list of (CSS class, list of `Segment`) tuples, see
+                `compile_template`
+    heading -- heading of the section of the output for this type of
+               reference. Sections are written in the order they are
+               registered.
+    OUTPUT:
+    render -- the compiled function that formats this type of
+              reference
+
+    """
+    render = compile_template(template)
+    FORMATTERS[entrytype] = render
+    TEMPLATES[entrytype] = template
+    for name in OUTPUT_FORMATS:
+        _COMPILED.pop((name, entrytype), None)
+    _REQUIRED_FIELDS.pop(entrytype, None)
+    SECTIONS[:] = [section for section in SECTIONS if section[0] != entrytype]
+    if heading is not None:
+        SECTIONS.append((entrytype, heading))
+    return render
+
+
+journal_article = register_entry_type(
+    "article", ARTICLE_TEMPLATE, "Journal Articles")
+in_proceedings = register_entry_type(
+    "inproceedings", INPROCEEDINGS_TEMPLATE, "Conference Publications and Posters")
+thesis = register_entry_type(
+    "phdthesis", THESIS_TEMPLATE, "Ph.D. Dissertation")
+register_entry_type("mastersthesis", THESIS_TEMPLATE, "Master's Thesis")
+# These types of reference can be formatted, but they have no section,
+# so that the output of existing bibliographies does not change. Add a
+# section for one of them by registering it again with a heading, such
+# as `register_entry_type("book", BOOK_TEMPLATE, "Books")`.
+register_entry_type("book", BOOK_TEMPLATE)
+register_entry_type("techreport", TECHREPORT_TEMPLATE)
+register_entry_type("misc", MISC_TEMPLATE)
+
+
+def section_types():
+    """Return the set of the types of reference that have a section in `SECTIONS`."""
+    return set(entrytype for entrytype, heading in SECTIONS)
+
+
+# Version of the formatted output. Bump this whenever the output of the
+# formatters changes, so that cached references are formatted again.
+FORMAT_VERSION = 2
+
+
+def get_formatter(entrytype, output_format="kramdown"):
+    """Return the function that formats a type of reference in an output format.
+
+    INPUT:
+    entrytype -- the BibTeX type of the reference, such as `article`
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    OUTPUT:
+    render -- function with the arguments (ref, faname) that returns
+              the formatted string of the reference
+
+    """
+    if output_format == "kramdown":
+        return FORMATTERS[entrytype]
+    if output_format == "jsonl":
+        if entrytype not in FORMATTERS:
+            raise KeyError(entrytype)
+        return json_line
+
+    key = (output_format, entrytype)
+    try:
+        return _COMPILED[key]
+    except KeyError:
+        render = compile_template(TEMPLATES[entrytype], OUTPUT_FORMATS[output_format])
+        _COMPILED[key] = render
+        return render
+
+
+def format_reference(ref, faname, cache=None, key=None, output_format="kramdown"):
+    """Format a reference with the formatter for its type.
+
+    INPUT:
+    ref -- dictionary of the fields of the reference
+    faname -- string of the initialized name of the author to whom
+              formatting will be applied
+    cache -- optional `RenderCache` to look the formatted reference
+             up in, and to store it in if it is not there yet
+    key -- the key of the reference in the cache, if it is already
+           known
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    OUTPUT:
+    reference -- the formatted string
+
+    """
+    if cache is None:
+        return get_formatter(ref["ENTRYTYPE"], output_format)(ref, faname)
+
+    if key is None:
+        key = entry_key(ref, faname, FORMAT_VERSION, output_format)
+    reference = cache.get(key)
+    if reference is None:
+        reference = get_formatter(ref["ENTRYTYPE"], output_format)(ref, faname)
+        cache.set(key, reference)
     return reference
 
 
-def in_proceedings(ref, faname):
-    authors = reorder(ref["author"], faname)
-    title = ref["title"]
-    year = ref["year"]
+def format_references(refs, faname, jobs=1, output_format="kramdown"):
+    """Format a list of references, in parallel if `jobs` > 1.
 
-    # Start building the reference string.
-    reference = (
-        '\n{{:.paper}}\n{open}{title}{close}{{:.papertitle}}  \n'
-        '{open}{authors}{close}{{:.authors}}  \n'
-        '{open}'.format(
-            open=open_span, close=close_span, title=title, authors=authors,
-            )
-        )
+    The formatters are pure functions of the reference and the
+    highlighted author, so the references are split into chunks and
+    formatted in a pool of `jobs` worker processes.
+    INPUT:
+    refs -- list of dictionaries of the fields of the references
+    faname -- string of the initialized name of the author to whom
+              formatting will be applied
+    jobs -- number of worker processes
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    OUTPUT:
+    references -- list of the formatted strings, in the same order as
+                  `refs`
 
-    # Since Mendeley doesn't allow customization of BibTeX
-    # output, we hack the "pages" field to contain the paper
-    # number for the conference paper. Not all of this type of
-    # reference will have this, so we check for it.
-    if "pages" in ref:
-        paperno = ref["pages"]
-        reference += paperno + ', '
-
-    # Insert the conference title, stored in the "booktitle"
-    # field.
-    conf = ref["booktitle"]
-    reference += conf + ', '
-    if "organization" in ref:
-        reference += ref["organization"] + ', '
-    if "address" in ref:
-        reference += ref["address"] + ', '
+    """
+    format_one = partial(format_reference, faname=faname, output_format=output_format)
+    if jobs <= 1 or len(refs) < 2:
+        return [format_one(ref) for ref in refs]
+
+    # A few chunks per worker balances the load without paying for
+    # sending every reference separately.
+    chunksize = max(1, len(refs) // (jobs * 4))
+    from multiprocessing import Pool
+    pool = Pool(jobs)
+    try:
+        return pool.map(format_one, refs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Reference(Mapping):
+    """A compact BibTeX entry whose fields are converted to unicode when used.
+
+    Keeping a full dict of every field for every entry costs a lot of
+    memory for large bibliographies, so the fields that the formatters
+    use are stored in slots, and any other fields, like the abstract or
+    the keywords, go in the `extra` dict. Fields that are repeated in
+    many entries, like the month or the journal, are interned so that
+    the entries share one copy of each string.
+
+    Converting LaTeX escapes to unicode is the slowest part of loading
+    a BibTeX file, so each field is converted the first time it is
+    looked up, and the converted value is kept in `decoded`. Fields
+    without any backslash or brace are used as they are.
+    """
 
-    month = ref["month"].title()
-    if month == "May":
-        month += ' '
+    #: Names of the fields stored in slots
+    FIELDS = ('ID', 'ENTRYTYPE', 'author', 'title', 'journal', 'booktitle', 'volume',
+              'number', 'pages', 'month', 'year', 'doi', 'annote', 'school',
+              'organization', 'address')
+
+    #: Names of the fields whose values are interned
+    INTERNED = frozenset(('ENTRYTYPE', 'month', 'year', 'journal', 'booktitle', 'school',
+                          'organization', 'address'))
+
+    __slots__ = FIELDS + ('extra', 'decoded')
+
+    def __init__(self, fields):
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        #: Dictionary of the fields that do not have a slot, or None
+        self.extra = None
+        #: Dictionary of the fields that have been converted, or None
+        self.decoded = None
+
+        for name, value in fields.items():
+            if name in _REFERENCE_SLOTS:
+                if name in self.INTERNED:
+                    value = sys.intern(value)
+                setattr(self, name, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+    def __getstate__(self):
+        # A tuple of the slots is smaller and faster to pickle than the
+        # default dict of the slots, which matters when the references
+        # are sent back from worker processes.
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            # Intern the values again, so references unpickled from
+            # different pickles share them too.
+            if value is not None and name in self.INTERNED:
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    def _raw(self, field):
+        """Return the value of `field` as it was parsed."""
+        if field in _REFERENCE_SLOTS:
+            value = getattr(self, field)
+            if value is None:
+                raise KeyError(field)
+            return value
+        if self.extra is None:
+            raise KeyError(field)
+        return self.extra[field]
+
+    @property
+    def raw(self):
+        """Dictionary of the fields as they were parsed."""
+        return {field: self._raw(field) for field in self}
+
+    def __getitem__(self, field):
+        value = self._raw(field)
+        if '\\' not in value and '{' not in value:
+            return value
+
+        if self.decoded is None:
+            self.decoded = {}
+        try:
+            return self.decoded[field]
+        except KeyError:
+            pass
+        from bibtexparser.customization import convert_to_unicode
+        value = convert_to_unicode({field: value})[field]
+        self.decoded[field] = value
+        return value
+
+    def __contains__(self, field):
+        if field in _REFERENCE_SLOTS:
+            return getattr(self, field) is not None
+        return self.extra is not None and field in self.extra
+
+    def __iter__(self):
+        for name in self.FIELDS:
+            if getattr(self, name) is not None:
+                yield name
+        if self.extra is not None:
+            for name in self.extra:
+                yield name
+
+    def __len__(self):
+        return (sum(getattr(self, name) is not None for name in self.FIELDS)
+                + len(self.extra or ()))
+
+    def __repr__(self):
+        return 'Reference({!r})'.format(self.raw)
+
+
+_REFERENCE_SLOTS = frozenset(Reference.FIELDS)
+
+
+def bibtexparser_record_parser():
+    """Return a function that parses one BibTeX record with `bibtexparser`.
+
+    The returned function takes the string of one record, starting with
+    `@`, and returns a list of dicts of the key, value pairs of the
+    entries in it. `@string` macros are remembered and applied to the
+    records parsed after them.
+    """
+    from bibtexparser.bparser import BibTexParser
+    parser = BibTexParser()
+
+    def parse_record(record):
+        # Clear the list of entries after we're done with it, so the
+        # parser does not accumulate them.
+        entries = parser.parse(record).entries
+        refs = list(entries)
+        del entries[:]
+        return refs
+
+    return parse_record
+
+
+def fast_record_parser():
+    """Return a function that parses one BibTeX record with `bibtextomd.fastparser`."""
+    from bibtextomd import fastparser
+    return fastparser.record_parser()
+
+
+# Map the name of each parser backend to a function that returns a
+# record parser, a function that takes the string of one record and
+# returns the list of dicts of the entries in it.
+PARSERS = {
+    "bibtexparser": bibtexparser_record_parser,
+    "fast": fast_record_parser,
+}
+
+
+def record_parser(parser="bibtexparser"):
+    """Return a function that parses one BibTeX record.
+
+    INPUT:
+    parser -- name of the parser backend in `PARSERS`
+    OUTPUT:
+    parse_record -- function that takes the string of one record,
+                    starting with `@`, and returns a list of the
+                    `Reference`s in it
+
+    """
+    parse_raw = PARSERS[parser]()
+
+    def parse_record(record):
+        return [Reference(entry) for entry in parse_raw(record)]
+
+    return parse_record
+
+
+def iter_bibtex(bib_file, stats=None, parser="bibtexparser"):
+    """Parse BibTeX entries one at a time and yield them as dicts.
+
+    The file is split into records the same way `bibtexparser` does
+    it (a new record starts on every line beginning with `@`), and
+    each record is handed to the parser as soon as it is complete, so
+    only one record is held in memory at a time. `@string` macros are
+    remembered by the parser and applied to all following entries.
+    INPUT:
+    bib_file -- iterable of the lines of a BibTeX file, such as an
+                open file object. Lines may also be bytes in utf-8,
+                so a memory-mapped file can be read with
+                `iter(mm.readline, b'')`.
+    stats -- optional `Stats` to add the time spent reading the file
+             and parsing to
+    parser -- name of the parser backend in `PARSERS`
+    OUTPUT:
+    Yields a `Reference` of the key, value pairs of each entry. The
+    fields are converted to unicode when they are first used.
+
+    """
+    parse_record = record_parser(parser)
+
+    if stats is not None:
+        bib_file = timed_iter(bib_file, stats, 'read')
+        untimed_parse_record = parse_record
+        timings = {'parse': 0.0}
+
+        def parse_record(record):
+            start = perf_counter()
+            entries = untimed_parse_record(record)
+            timings['parse'] += perf_counter() - start
+            return entries
+
+    try:
+        for entry in iter_records(bib_file, parse_record):
+            yield entry
+    finally:
+        if stats is not None:
+            stats.add_time('parse', timings['parse'])
+
+
+def iter_records(bib_file, parse_record):
+    """Split the lines of a BibTeX file into records and yield their entries.
+
+    INPUT:
+    bib_file -- iterable of the lines of a BibTeX file
+    parse_record -- function that returns the list of entries in a
+                    record, such as the one returned by `record_parser`
+
+    """
+    record = ''
+    for linenumber, line in enumerate(bib_file):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        # Some files have a byte-order mark at the start
+        if linenumber == 0 and line.startswith('\ufeff'):
+            line = line[1:]
+        if line.strip().startswith('@'):
+            if record:
+                for entry in parse_record(record):
+                    yield entry
+            record = line.lstrip()
+        else:
+            record += line
+
+    if record:
+        for entry in parse_record(record):
+            yield entry
+
+
+# Look up table for the number of a month. BibTeX files usually use
+# the three letter month macros, but full month names and numeric
+# months show up too.
+MONTHS = {}
+for number, name in enumerate(
+        ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+         'august', 'september', 'october', 'november', 'december'], start=1):
+    MONTHS[name] = number
+    MONTHS[name[:3]] = number
+    MONTHS[str(number)] = number
+    MONTHS['{:02d}'.format(number)] = number
+# Allow the common abbreviation for September as well.
+MONTHS['sept'] = 9
+
+
+def month_number(month):
+    """Return the number of the month in the string `month`.
+
+    Accepts three letter abbreviations (`aug`), full month names
+    (`August`) and numeric months (`8` or `08`), in any case and with
+    an optional trailing period.
+    """
+    try:
+        return MONTHS[month.strip().rstrip('.').lower()]
+    except KeyError:
+        raise ValueError("Unknown month {!r}".format(month))
+
+
+def sort_key(ref):
+    """Return the key to sort a reference by year, then month.
+
+    References without a month, or with a month that is not known, come
+    after the other references of the same year, and references without
+    a year come last. The types of reference that are formatted are
+    checked by `check_reference` before they are sorted, so this only
+    matters for the other types.
+    """
+    year = ref["year"] if "year" in ref else ''
+    if "month" not in ref:
+        return (year, 0)
+    try:
+        return (year, month_number(ref["month"]))
+    except ValueError:
+        return (year, 0)
+
+
+def published_since(ref, since):
+    """Return whether a reference is from the year `since` or later.
+
+    The year is read as it was parsed, so the reference does not have
+    to be converted to unicode. References whose year is not a number,
+    like "in press", are kept.
+    """
+    try:
+        return int(ref._raw("year").strip().strip('{}')) >= since
+    except (KeyError, ValueError):
+        return True
+
+
+class InvalidReferenceError(ValueError):
+    """Raised with `strict` when some references cannot be sorted or formatted.
+
+    `problems` is the list of (BibTeX file, ID, problem) tuples of all
+    the problems that were found.
+    """
+
+    def __init__(self, message, problems):
+        super(InvalidReferenceError, self).__init__(message)
+        self.problems = problems
+
+
+def required_fields(entrytype):
+    """Return the fields that a type of reference cannot be formatted without.
+
+    The year, which every reference needs, is not included.
+    """
+    fields = _REQUIRED_FIELDS.get(entrytype)
+    if fields is None:
+        fields = []
+        for css_class, segments in TEMPLATES.get(entrytype, ()):
+            for segment in segments:
+                if (segment.required and segment.field != 'date' and
+                        segment.field not in fields):
+                    fields.append(segment.field)
+        _REQUIRED_FIELDS[entrytype] = fields
+    return fields
+
+
+def check_authors(names):
+    """Return the problem with a string of author names, or None if it can be formatted.
+
+    Each name has to be in the style "Last, First Middle", like
+    `tidy_name` expects.
+    """
+    for namestring in AND_RE.split(names):
+        namestring = namestring.strip()
+        if not namestring:
+            continue
+        try:
+            # Call the function behind the memo, so the raw names do
+            # not push the formatted names out of it.
+            tidy_name.__wrapped__(namestring)
+        except IndexError:
+            return "badly formed author {!r}, expected 'Last, First'".format(namestring)
+    return None
+
+
+def check_reference(ref, entrytypes=None):
+    """Return the list of the problems that keep a reference from being sorted or formatted.
+
+    Only the types of reference in `entrytypes` are checked, which
+    defaults to the types with a section in `SECTIONS`, because the
+    other types are never written. They need a year, a month that
+    `month_number` knows if they have a month, the fields that are
+    required by their template, and author names in the style "Last,
+    First". The author names are checked as they were parsed, and only
+    the month is converted to unicode to check it.
+    """
+    problems = []
+    if entrytypes is None:
+        entrytypes = section_types()
+    if ref["ENTRYTYPE"] not in entrytypes:
+        return problems
+    if "year" not in ref:
+        problems.append("missing year")
+    if "month" in ref:
+        try:
+            month_number(ref["month"])
+        except ValueError:
+            problems.append("unknown month {!r}".format(ref["month"]))
+    for field in required_fields(ref["ENTRYTYPE"]):
+        if field not in ref:
+            problems.append("missing {}".format(field))
+    if "author" in ref:
+        problem = check_authors(ref._raw("author") if isinstance(ref, Reference)
+                                else ref["author"])
+        if problem is not None:
+            problems.append(problem)
+    return problems
+
+
+def validate_references(refsdict, entrytypes=None):
+    """Check all the references at once, and remove the invalid ones.
+
+    INPUT:
+    refsdict -- dictionary of references, keyed by their ID. The
+                references with any problems are removed from it.
+    entrytypes -- types of reference to check, see `check_reference`
+    OUTPUT:
+    problems -- list of (ID, problem) tuples of every problem of every
+                reference, in the order of `refsdict`
+
+    """
+    if entrytypes is None:
+        entrytypes = section_types()
+    problems = []
+    for ID, ref in list(refsdict.items()):
+        ref_problems = check_reference(ref, entrytypes)
+        if ref_problems:
+            del refsdict[ID]
+            problems.extend((ID, problem) for problem in ref_problems)
+    return problems
+
+
+def report_problems(problems, strict=False):
+    """Warn about the invalid references, or raise an error with `strict`.
+
+    All the problems are reported at once, so that they can all be
+    fixed before running again.
+    INPUT:
+    problems -- list of (BibTeX file, ID, problem) tuples
+    strict -- raise an `InvalidReferenceError` instead of warning
+
+    """
+    if not problems:
+        return
+    count = len(set((bib_file_name, ID) for bib_file_name, ID, problem in problems))
+    lines = ['{} {} invalid reference{}:\n'.format(
+        'Found' if strict else 'Skipped', count, '' if count == 1 else 's')]
+    for bib_file_name, ID, problem in problems:
+        lines.append('  {}: {}: {}\n'.format(bib_file_name, ID, problem))
+    message = ''.join(lines)
+    if strict:
+        raise InvalidReferenceError(message, problems)
+    warnings.warn(message)
+
+
+def sort_references(refsdict, limit=None):
+    """Group the references by type and sort them by date.
+
+    INPUT:
+    refsdict -- dictionary of references, keyed by their ID
+    limit -- if given, only the newest `limit` references of each type
+             are kept. They are picked with a heap instead of sorting
+             all the references of the type.
+    OUTPUT:
+    sort_dict -- dictionary whose keys are the types of reference and
+                 whose values are the lists of references of that type,
+                 newest first.
+
+    """
+    # Put each reference into the bucket for its type, typically
+    # `article`, `inproceedings`, and `phdthesis`, computing the sort
+    # key only once per reference.
+    buckets = {}
+    for ref in refsdict.values():
+        buckets.setdefault(ref["ENTRYTYPE"], []).append((sort_key(ref), ref))
+
+    # Sort each bucket by year, then month, newest first. The sort is
+    # stable, so references with the same date stay in the same order
+    # as they were in the BibTeX file.
+    sort_dict = {}
+    for t, bucket in buckets.items():
+        if limit is not None and limit < len(bucket):
+            # `nlargest` gives the same references in the same order
+            # as sorting the whole bucket and keeping the first `limit`.
+            bucket = nlargest(limit, bucket, key=itemgetter(0))
+        else:
+            bucket.sort(key=itemgetter(0), reverse=True)
+        sort_dict[t] = [ref for key, ref in bucket]
+
+    return sort_dict
+
+
+def author_index(refs):
+    """Map the initialized name of each author to the IDs of their references.
+
+    INPUT:
+    refs -- iterable of references
+    OUTPUT:
+    index -- dictionary whose keys are the names of the authors, like
+             'F.A. Author', and whose values are the lists of the IDs
+             of their references, in the order of `refs`
+
+    """
+    index = {}
+    for ref in refs:
+        if "author" not in ref:
+            continue
+        for name in tidy_names(ref["author"]):
+            ids = index.setdefault(name, [])
+            # An author listed twice on the same reference only counts
+            # once.
+            if not ids or ids[-1] != ref["ID"]:
+                ids.append(ref["ID"])
+    return index
+
+
+class Bibliography(dict):
+    """Dictionary of sorted references by type, with an index of the authors.
+
+    The keys are the types of reference and the values are the lists
+    of references of that type, newest first, as returned by
+    `sort_references`. `references` maps the ID of each reference to
+    the reference, and `author_index` maps the initialized name of each
+    author to the IDs of their references, so the references of one
+    author are found without looking at the others. With `limit`, only
+    the newest `limit` references of each type are kept. `problems` is
+    the list of (BibTeX file, ID, problem) tuples of the invalid
+    references that were left out, see `validate_references`.
+    """
+
+    def __init__(self, refsdict, limit=None, problems=None):
+        super(Bibliography, self).__init__(sort_references(refsdict, limit))
+        if limit is not None:
+            refsdict = dict((ref["ID"], ref) for refs in self.values() for ref in refs)
+        #: Dictionary of the references, keyed by their ID
+        self.references = refsdict
+        self.problems = problems if problems is not None else []
+        self._author_index = None
+
+    @property
+    def author_index(self):
+        """Dictionary of the IDs of the references of each author.
+
+        The index is built the first time it is used, because the
+        author of every reference has to be converted to unicode for
+        it.
+        """
+        if self._author_index is None:
+            self._author_index = author_index(self.references.values())
+        return self._author_index
+
+    def ids_of(self, faname):
+        """Return the set of the IDs of the references of `faname`."""
+        if faname is None:
+            return frozenset()
+        return frozenset(self.author_index.get(faname, ()))
+
+    def by_author(self, faname, limit=None):
+        """Return a `Bibliography` with only the references of `faname`.
+
+        With `limit`, only the newest `limit` references of each type
+        are kept.
+        """
+        return Bibliography(dict((ID, self.references[ID])
+                                 for ID in self.author_index.get(faname, ())), limit,
+                            self.problems)
+
+    def select(self, since=None, limit=None):
+        """Return a `Bibliography` with only the newest references.
+
+        INPUT:
+        since -- if given, only the references from this year or later
+                 are kept
+        limit -- if given, only the newest `limit` references of each
+                 type are kept
+        OUTPUT:
+        bibliography -- a new `Bibliography`
+
+        """
+        # The references are already sorted, so the newest ones are
+        # the first ones of each type.
+        selected = {}
+        for refs in self.values():
+            if since is not None:
+                refs = [ref for ref in refs if published_since(ref, since)]
+            for ref in refs[:limit]:
+                selected[ref["ID"]] = ref
+        return Bibliography(selected, problems=self.problems)
+
+
+def load_bibtex(bib_file_name, stats=None, parser="bibtexparser", snapshot=False,
+                since=None, limit=None, strict=False, jobs=1):
+    # Open and parse the BibTeX file in `bib_file_name` using the
+    # `parser` backend. Get a dictionary of dictionaries of key, value
+    # pairs from the BibTeX file. The structure is
+    # {ID:{authors:...},ID:{authors:...}}. If `stats` is given, the
+    # time of each stage is added to it. The references are returned
+    # sorted in a `Bibliography`, which also indexes them by author.
+    # With `snapshot`, the parsed references are saved next to the
+    # BibTeX file and loaded from there as long as the file does not
+    # change. With `since`, references from before that year are
+    # dropped as soon as they are parsed, and with `limit`, only the
+    # newest `limit` references of each type are kept. The references
+    # that cannot be sorted or formatted are left out with a warning
+    # that lists all of them, or, with `strict`, raise an
+    # `InvalidReferenceError` before the references are sorted. With
+    # `jobs` greater than 1, the file is split into chunks that are
+    # parsed in that many processes, which gives the same references.
+    if snapshot and (since is not None or limit is not None):
+        # The snapshot has all the references, so they are selected
+        # after it is loaded or written.
+        return load_bibtex(bib_file_name, stats, parser, snapshot,
+                           strict=strict, jobs=jobs).select(since, limit)
+
+    if snapshot:
+        from bibtextomd.snapshot import read_snapshot, write_snapshot
+        start = perf_counter()
+        bibliography = read_snapshot(bib_file_name, parser)
+        if stats is not None:
+            stats.add_time('snapshot', perf_counter() - start)
+        if bibliography is not None:
+            # The snapshot may have been written for another name of
+            # the same file.
+            bibliography.problems = [(bib_file_name, ID, problem)
+                                     for name, ID, problem in bibliography.problems]
+            report_problems(bibliography.problems, strict)
+            return bibliography
+        stat = os.stat(bib_file_name)
+
+    refsdict = {}
+    if jobs > 1:
+        from bibtextomd.parallel import parse_parallel
+        start = perf_counter()
+        for ref in parse_parallel(bib_file_name, jobs, parser):
+            if since is None or published_since(ref, since):
+                refsdict[ref["ID"]] = ref
+        if stats is not None:
+            stats.add_time('parse', perf_counter() - start)
     else:
-        month += '. '
+        with open(bib_file_name, 'r', encoding='utf-8') as bib_file:
+            for ref in iter_bibtex(bib_file, stats, parser):
+                if since is None or published_since(ref, since):
+                    refsdict[ref["ID"]] = ref
+
+    start = perf_counter()
+    problems = [(bib_file_name, ID, problem)
+                for ID, problem in validate_references(refsdict)]
+    if stats is not None:
+        stats.add_time('validate', perf_counter() - start)
+    report_problems(problems, strict)
+
+    if stats is None:
+        bibliography = Bibliography(refsdict, limit, problems)
+    else:
+        with stats.stage('sort'):
+            bibliography = Bibliography(refsdict, limit, problems)
+
+    if snapshot:
+        start = perf_counter()
+        # Convert the fields that are formatted to unicode and index
+        # the authors now, so loading the snapshot gives references
+        # that are ready to use.
+        for ref in refsdict.values():
+            for field in ref:
+                if field in _REFERENCE_SLOTS:
+                    ref[field]
+        bibliography.author_index
+        write_snapshot(bib_file_name, parser, bibliography, stat)
+        if stats is not None:
+            stats.add_time('snapshot', perf_counter() - start)
+    return bibliography
+
+
+def expand_bib_files(patterns):
+    """Return the names of the BibTeX files given by names or glob patterns.
+
+    The files matching each pattern are sorted by name, and a file
+    given more than once is only returned the first time. A name
+    without any wildcards is returned even if the file does not exist,
+    so that opening it gives a useful error.
+    """
+    import glob
+    bib_file_names = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            names = sorted(glob.glob(pattern))
+        else:
+            names = [pattern]
+        for name in names:
+            if name not in bib_file_names:
+                bib_file_names.append(name)
+    return bib_file_names
 
-    reference += (
-        '{month}{year}{close}{{:.journal}}  \n'.format(
-            month=month, year=year, close=close_span,
-            )
-        )
 
+# Prefixes that are removed from a DOI before it is compared.
+DOI_PREFIXES = ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/',
+                'http://dx.doi.org/', 'doi:')
+
+# Anything that is not a letter or a digit, which is ignored when
+# titles are compared.
+NOT_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_doi(doi):
+    """Return a DOI in lower case, without any URL or doi: prefix."""
+    doi = doi.strip().lower()
+    for prefix in DOI_PREFIXES:
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+            break
+    return doi.strip()
+
+
+def duplicate_keys(ref):
+    """Return the keys by which a reference is recognized in another BibTeX file.
+
+    A reference is the same as another one if they have the same ID,
+    the same DOI, or the same title, year, and last name of the first
+    author. DOIs are compared without case or URL prefix, and titles
+    are compared without case, braces, or punctuation.
+    INPUT:
+    ref -- the reference
+    OUTPUT:
+    keys -- list of (kind, value) tuples, where kind is 'ID', 'DOI',
+            or 'title'
+
+    """
+    keys = [('ID', ref["ID"])]
     if "doi" in ref:
-        reference += (
-            '{open}{strong}DOI:{strong} [{doi}]'
-            '(https://dx.doi.org/{doi}){close}{{:.doi}}  \n'.format(
-                open=open_span, strong=strong, doi=ref["doi"],
-                close=close_span,
-                )
-            )
-
-    # Extra comments, such as links to files, should be stored
-    # as "Notes" for each reference in Mendeley. Mendeley will
-    # export this field with the tag "annote" in BibTeX.
-    if "annote" in ref:
-        reference += (
-            '{open}{annote}{close}{{:.comment}}  \n'.format(
-                open=open_span, annote=ref["annote"].replace('\\', ''),
-                close=close_span,
-                )
-            )
-    return reference
+        doi = normalize_doi(ref["doi"])
+        if doi:
+            keys.append(('DOI', doi))
+    if "title" in ref and "year" in ref:
+        title = NOT_WORD_RE.sub(' ', ref["title"].lower()).strip()
+        first_author = ''
+        if "author" in ref:
+            names = tidy_names(ref["author"])
+            if names:
+                first_author = names[0].rsplit(' ', 1)[-1].lower()
+        if title:
+            keys.append(('title', (title, ref["year"].strip(), first_author)))
+    return keys
+
+
+def merge_references(refsdicts, bib_file_names):
+    """Merge the references of several BibTeX files, dropping the duplicates.
+
+    Each reference is looked up in a dictionary of the keys from
+    `duplicate_keys` of the references kept so far, so the references
+    are merged in linear time. Only references from different BibTeX
+    files are duplicates of each other, and the reference from the file
+    that is given first is kept.
+    INPUT:
+    refsdicts -- list of the dictionaries of references of each BibTeX
+                 file, keyed by their ID
+    bib_file_names -- list of the names of the BibTeX files
+    OUTPUT:
+    refsdict -- dictionary of the merged references, keyed by their ID
+    duplicates -- list of (kept, kept_file, dropped, dropped_file, kind)
+                  tuples for each reference that was dropped, where kind
+                  is the kind of the key that matched
 
+    """
+    refsdict = {}
+    duplicates = []
+    # Dictionary of the first (file index, reference) with each key
+    index = {}
+    for i, (refs, bib_file_name) in enumerate(zip(refsdicts, bib_file_names)):
+        for ref in refs.values():
+            keys = duplicate_keys(ref)
+            for key in keys:
+                match = index.get(key)
+                if match is not None and match[0] != i:
+                    duplicates.append((match[1], bib_file_names[match[0]], ref,
+                                       bib_file_name, key[0]))
+                    break
+            else:
+                refsdict[ref["ID"]] = ref
+                for key in keys:
+                    index.setdefault(key, (i, ref))
+    return refsdict, duplicates
+
+
+def format_duplicates(duplicates):
+    """Return the report of the duplicates dropped by `merge_references`."""
+    if not duplicates:
+        return ''
+    lines = ['Merged {} duplicate reference{}:\n'.format(
+        len(duplicates), '' if len(duplicates) == 1 else 's')]
+    for kept, kept_file, dropped, dropped_file, kind in duplicates:
+        lines.append('  {} ({}) into {} ({}): same {}\n'.format(
+            dropped["ID"], dropped_file, kept["ID"], kept_file, kind))
+    return ''.join(lines)
+
+
+def _load_references(item):
+    """Parse one BibTeX file for `load_bibtex_files`, in a worker process."""
+    bib_file_name, parser, snapshot, since = item
+    # The invalid references of all the files are reported together by
+    # `load_bibtex_files`.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        bibliography = load_bibtex(bib_file_name, parser=parser, snapshot=snapshot,
+                                   since=since)
+    return bibliography.references, bibliography.problems
+
+
+def load_bibtex_files(bib_file_names, stats=None, parser="bibtexparser", snapshot=False,
+                      jobs=None, since=None, limit=None, strict=False):
+    """Parse several BibTeX files at the same time and merge their references.
+
+    Each BibTeX file is parsed in its own process, up to `jobs`
+    processes at once, and the references are merged by
+    `merge_references`.
+    INPUT:
+    bib_file_names -- list of the names of the BibTeX files
+    stats -- optional `Stats` to add the time of each stage to
+    parser -- name of the parser backend in `PARSERS`
+    snapshot -- whether to use a snapshot of each BibTeX file
+    jobs -- maximum number of processes, by default the number of CPUs
+    since -- if given, only the references from this year or later are
+             kept
+    limit -- if given, only the newest `limit` merged references of
+             each type are kept
+    strict -- raise an `InvalidReferenceError` if any reference is
+              invalid, instead of leaving it out with a warning
+    OUTPUT:
+    bibliography -- the merged references in a `Bibliography`
+    duplicates -- the dropped duplicates, as returned by
+                  `merge_references`
 
-def thesis(ref, faname):
-    authors = reorder(ref["author"], faname)
-    title = ref["title"]
-    year = ref["year"]
+    """
+    items = [(bib_file_name, parser, snapshot, since) for bib_file_name in bib_file_names]
+    start = perf_counter()
+    processes = min(len(items), jobs or os.cpu_count() or 1)
+    if processes > 1:
+        from multiprocessing import Pool
+        with Pool(processes) as pool:
+            loaded = pool.map(_load_references, items)
+    else:
+        loaded = [_load_references(item) for item in items]
+    if stats is not None:
+        stats.add_time('parse', perf_counter() - start)
+        start = perf_counter()
 
-    reference = (
-        '\n{{:.paper}}\n{open}{title}{close}{{:.papertitle}}  \n'
-        '{open}{authors}{close}{{:.authors}}  \n'
-        '{open}'.format(
-            open=open_span, close=close_span, title=title, authors=authors,
-            )
-        )
-    if "school" in ref:
-        reference += ref["school"] + ', '
+    problems = [problem for refs, file_problems in loaded for problem in file_problems]
+    report_problems(problems, strict)
+
+    refsdict, duplicates = merge_references([refs for refs, file_problems in loaded],
+                                            bib_file_names)
+    bibliography = Bibliography(refsdict, limit, problems)
+    if stats is not None:
+        stats.add_time('sort', perf_counter() - start)
+    return bibliography, duplicates
+
+
+# Number of references sent to a worker process at once when streaming.
+STREAM_CHUNKSIZE = 64
+
+
+def _stream_reference(item):
+    """Format one reference for `stream_bibtex`.
+
+    This is called in the worker processes when formatting in
+    parallel, so it only returns the fields that `stream_bibtex` keeps.
+    """
+    ref, faname, key, reference, output_format = item
+    if reference is None:
+        reference = format_reference(ref, faname, output_format=output_format)
+    slim_ref = {
+        "ENTRYTYPE": ref["ENTRYTYPE"],
+        "ID": ref["ID"],
+        "year": ref["year"],
+        "reference": reference,
+        "key": key,
+    }
     if "month" in ref:
-        month = ref["month"].title()
-        if month == "May":
-            month += ' '
+        slim_ref["month"] = ref["month"]
+    return slim_ref
+
+
+def stream_bibtex(bib_file_name, faname, cache=None, jobs=1, stats=None,
+                  parser="bibtexparser", only_author=None, output_format="kramdown",
+                  since=None, limit=None, strict=False):
+    """Format each reference as soon as it is parsed.
+
+    Only the fields needed to sort the references and the formatted
+    string are kept for each entry, so the peak memory does not depend
+    on the size of the raw BibTeX entries.
+    INPUT:
+    bib_file_name -- name of the BibTeX file
+    faname -- string of the initialized name of the author to whom
+              formatting will be applied
+    cache -- optional `RenderCache` of formatted references
+    jobs -- number of worker processes to format the references
+    stats -- optional `Stats` to add the time of each stage to. The
+             time that is not spent reading, parsing, or sorting is
+             counted as rendering.
+    parser -- name of the parser backend in `PARSERS`
+    only_author -- if given, only the references of this author are
+                   kept
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    since -- if given, the references from before this year are
+             skipped before they are formatted
+    limit -- if given, only the newest `limit` references of each type
+             are kept. The references that are older than the newest
+             `limit` so far are skipped before they are formatted. If
+             an ID comes up twice, the file is read again without
+             skipping any references.
+    strict -- raise an `InvalidReferenceError` if any reference is
+              invalid, instead of leaving it out with a warning
+    OUTPUT:
+    sort_dict -- same structure as returned by `load_bibtex`, but each
+                 reference only has the keys `ENTRYTYPE`, `ID`, `year`,
+                 `month` if it has a month, `reference`, the formatted
+                 string, and `key`, the key of the reference in the
+                 cache.
+
+    """
+    def items(bib_file, prune):
+        # Look each reference up in the cache here, so that only the
+        # references that are not cached are formatted. The references
+        # without a section are never written, so they are skipped.
+        for ref in iter_bibtex(bib_file, stats, parser):
+            if ref["ENTRYTYPE"] not in entrytypes:
+                continue
+            if prune:
+                # A later reference with the same ID replaces the
+                # earlier one, which could let a reference that was
+                # already skipped back in, so the file is read again
+                # without skipping any references.
+                if ref["ID"] in seen:
+                    duplicates.append(ref["ID"])
+                    return
+                seen.add(ref["ID"])
+            if since is not None and not published_since(ref, since):
+                continue
+            ref_problems = check_reference(ref, entrytypes)
+            if ref_problems:
+                problems.extend((bib_file_name, ref["ID"], problem) for problem in ref_problems)
+                continue
+            names = ()
+            if faname is not None or only_author is not None:
+                names = tidy_names(ref["author"]) if "author" in ref else []
+            if only_author is not None and only_author not in names:
+                continue
+            # Only highlight the references of the author, like
+            # `convert` does.
+            ref_faname = faname if faname in names else None
+            if ref_faname is not None:
+                highlighted.append(ref["ID"])
+            if prune and not newest(ref):
+                continue
+            key = reference = None
+            if cache is not None:
+                key = entry_key(ref, ref_faname, FORMAT_VERSION, output_format)
+                reference = cache.get(key)
+            yield ref, ref_faname, key, reference, output_format
+
+    def newest(ref):
+        # Keep a heap of the sort keys of the newest `limit` references
+        # of each type so far. A reference that is not newer than all
+        # of them can never be kept, so it is not formatted. Ties go to
+        # the earlier reference, like in `sort_references`.
+        heap = heaps.setdefault(ref["ENTRYTYPE"], [])
+        key = sort_key(ref)
+        if len(heap) < limit:
+            heappush(heap, key)
+        elif heap[0] < key:
+            heapreplace(heap, key)
         else:
-            month += '. '
-        reference += month
-
-    reference += year + close_span + '{:.journal}  \n'
-
-    if "annote" in ref:
-        reference += (
-            '{open}{annote}{close}{{:.comment}}  \n'.format(
-                open=open_span, annote=ref["annote"].replace('\\', ''),
-                close=close_span,
-                )
-            )
-    return reference
+            return False
+        return True
+
+    def read(prune):
+        refsdict = {}
+        pool = None
+        with open(bib_file_name, 'r', encoding='utf-8') as bib_file:
+            if jobs > 1:
+                from multiprocessing import Pool
+                pool = Pool(jobs)
+                slim_refs = pool.imap(_stream_reference, items(bib_file, prune),
+                                      STREAM_CHUNKSIZE)
+            else:
+                slim_refs = map(_stream_reference, items(bib_file, prune))
+            try:
+                for ref in slim_refs:
+                    if cache is not None:
+                        cache.set(ref["key"], ref["reference"])
+                    refsdict[ref["ID"]] = ref
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+        return refsdict
+
+    heaps = {}
+    seen = set()
+    duplicates = []
+    entrytypes = section_types()
+    highlighted = []
+    problems = []
+    start = perf_counter()
+    if stats is not None:
+        timed = sum(stats.times.values())
+    refsdict = read(limit is not None)
+    if duplicates:
+        # The references that were already formatted are in the
+        # cache, if there is one.
+        del highlighted[:]
+        del problems[:]
+        refsdict = read(False)
+
+    # The references are already formatted, so the invalid ones can
+    # only be reported after the whole file is read.
+    report_problems(problems, strict)
+    if faname is not None and not highlighted:
+        warnings.warn("Couldn't find {} in any reference in {}. Sorry!".format(
+            faname, bib_file_name))
+
+    if stats is None:
+        return Bibliography(refsdict, limit, problems)
+
+    timed = sum(stats.times.values()) - timed
+    stats.add_time('render', perf_counter() - start - timed)
+    with stats.stage('sort'):
+        return Bibliography(refsdict, limit, problems)
+
+
+def iter_section(heading, refs, render, output_format="kramdown"):
+    """Yield the formatted strings of one section of the output.
 
+    INPUT:
+    heading -- the heading of the section
+    refs -- list of sorted references in the section
+    render -- function that returns the formatted string of a
+              reference
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    OUTPUT:
+    Yields the heading of the section, the heading of each year, and
+    each formatted reference. Output formats without headings only
+    yield the references.
 
-def load_bibtex(bib_file_name):
-    # Open and parse the BibTeX file in `bib_file_name` using
-    # `bibtexparser`
-    with open(bib_file_name, 'r') as bib_file:
-        bp = BibTexParser(bib_file.read(), customization=convert_to_unicode)
-
-    # Get a dictionary of dictionaries of key, value pairs from the
-    # BibTeX file. The structure is
-    # {ID:{authors:...},ID:{authors:...}}.
-    refsdict = bp.get_entry_dict()
-
-    # Create a list of all the types of documents found in the BibTeX
-    # file, typically `article`, `inproceedings`, and `phdthesis`.
-    # Dedupe the list.
-    entry_types = []
-    for k, ref in refsdict.items():
-        entry_types.append(ref["ENTRYTYPE"])
-    entry_types = set(entry_types)
-
-    # For each of the types of reference, we need to sort each by month
-    # then year. We store the dictionary representing each reference in
-    # a sorted list for each type of reference. Then we store each of
-    # these sorted lists in a dictionary whose key is the type of
-    # reference and value is the list of dictionaries.
-    sort_dict = {}
-    for t in entry_types:
-        temp = sorted([val for key, val in refsdict.items()
-                      if val["ENTRYTYPE"] == t], key=lambda l:
-                      datetime.strptime(l["month"], '%b').month, reverse=True)
-        sort_dict[t] = sorted(temp, key=lambda k: k["year"], reverse=True)
+    """
+    markup = OUTPUT_FORMATS[output_format]
+    if markup.section is None:
+        for ref in refs:
+            yield render(ref)
+        return
 
-    return sort_dict
+    if markup.escape is not None:
+        heading = markup.escape(heading)
+    yield markup.section.format(heading=heading)
+
+    # To get the year numbering correct, we have to set a dummy value
+    # for pubyear. If the year of the current reference is not equal to
+    # the year of the previous reference, we need to set `pubyear` equal
+    # to `year` and write the year heading.
+    pubyear = ''
+    for ref in refs:
+        year = ref["year"]
+        if year != pubyear:
+            pubyear = year
+            yield markup.year.format(year=year)
+
+        yield render(ref)
+
+
+def format_section(heading, refs, render, output_format="kramdown"):
+    """Return the formatted string of one section of the output.
+
+    INPUT:
+    heading -- the heading of the section
+    refs -- list of sorted references in the section
+    render -- function that returns the formatted string of a
+              reference
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    OUTPUT:
+    section -- the formatted section, with a heading for each year
+
+    """
+    return ''.join(iter_section(heading, refs, render, output_format))
+
+
+def iter_sections(sort_dict, render, output_format="kramdown"):
+    """Yield the formatted sections of the output, grouped by type and year.
+
+    The sections are yielded in the order of `SECTIONS`, separated by
+    blank lines. Sections without any references are left out.
+    INPUT:
+    sort_dict -- dictionary of sorted references, as returned by
+                 `load_bibtex`
+    render -- function that returns the formatted string of a
+              reference
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+
+    """
+    separator = ''
+    for entrytype, heading in SECTIONS:
+        if entrytype not in sort_dict:
+            continue
+        yield separator
+        yield format_section(heading, sort_dict[entrytype], render, output_format)
+        separator = OUTPUT_FORMATS[output_format].separator
+
+
+def render(entries, author=None, sections=None, parser="bibtexparser",
+           output_format="kramdown", strict=False):
+    """Yield the formatted markdown of a bibliography in small chunks.
+
+    This does the same as the command line tool without reading or
+    writing any files, so the output can be streamed, for example as
+    the response of a web application. The references have to be
+    sorted before the first one is formatted, but each reference is
+    only formatted when its chunk is needed. The references are checked
+    like in `load_bibtex` before the first chunk is yielded, and the
+    invalid ones are left out with a warning.
+    INPUT:
+    entries -- the references, either a dictionary of sorted
+               references as returned by `load_bibtex`, an iterable of
+               the dicts of the references as yielded by `iter_bibtex`,
+               or a text stream or string of BibTeX
+    author -- string of the initialized name of the author to whom
+              formatting will be applied, such as 'F.A. Author'
+    sections -- list of the types of reference, or of the (type of
+                reference, heading) sections, to write. Defaults to
+                `SECTIONS`.
+    parser -- name of the parser backend in `PARSERS`, used when
+              `entries` is BibTeX
+    output_format -- name of the output format in `OUTPUT_FORMATS`
+    strict -- raise an `InvalidReferenceError` if any reference is
+              invalid, instead of leaving it out with a warning
+    OUTPUT:
+    Yields the strings of the output, which are the headings of the
+    sections and years and each formatted reference.
+
+    """
+    if sections is None:
+        sections = SECTIONS
+    else:
+        headings = dict(SECTIONS)
+        sections = [(section, headings[section]) if isinstance(section, str) else section
+                    for section in sections]
+    entrytypes = set(entrytype for entrytype, heading in sections)
+
+    if isinstance(entries, Mapping):
+        sort_dict = entries
+        # `load_bibtex` already checked the references of the types
+        # with a section, and reported the invalid ones.
+        checked = section_types() if isinstance(sort_dict, Bibliography) else set()
+        problems = []
+        valid = {}
+        for entrytype in entrytypes - checked:
+            if entrytype not in sort_dict:
+                continue
+            refs = []
+            for ref in sort_dict[entrytype]:
+                ref_problems = check_reference(ref, entrytypes)
+                problems.extend((ref["ID"], problem) for problem in ref_problems)
+                if not ref_problems:
+                    refs.append(ref)
+            valid[entrytype] = refs
+        source = '<references>'
+    else:
+        if isinstance(entries, str):
+            source = '<string>'
+            entries = iter_bibtex(entries.splitlines(True), parser=parser)
+        elif hasattr(entries, 'read'):
+            source = getattr(entries, 'name', '<stream>')
+            entries = iter_bibtex(entries, parser=parser)
+        else:
+            source = '<references>'
+        # Later references with the same ID replace earlier ones, like
+        # in `load_bibtex`.
+        refsdict = dict((ref["ID"], ref) for ref in entries)
+        problems = validate_references(refsdict, entrytypes)
+        sort_dict = Bibliography(refsdict)
+        valid = {}
+    report_problems([(source, ID, problem) for ID, problem in problems], strict)
+
+    # With an index of the authors, only the references of the author
+    # are formatted with highlighting.
+    if isinstance(sort_dict, Bibliography):
+        highlighted = sort_dict.ids_of(author)
+
+        def render_reference(ref):
+            return format_reference(ref, author if ref["ID"] in highlighted else None,
+                                    output_format=output_format)
+    else:
+        def render_reference(ref):
+            return format_reference(ref, author, output_format=output_format)
+
+    separator = None
+    for entrytype, heading in sections:
+        refs = valid.get(entrytype, sort_dict.get(entrytype))
+        if not refs:
+            continue
+        if separator:
+            yield separator
+        separator = OUTPUT_FORMATS[output_format].separator
+        for chunk in iter_section(heading, refs, render_reference, output_format):
+            yield chunk
+
+
+def write_references(out_file, sort_dict, render):
+    """Write the formatted references, grouped by type and year.
+
+    INPUT:
+    out_file -- file object to write to
+    sort_dict -- dictionary of sorted references, as returned by
+                 `load_bibtex`
+    render -- function that returns the formatted string of a
+              reference
+
+    """
+    out_file.writelines(iter_sections(sort_dict, render))
+
+
+def write_output(output_file_name, chunks):
+    """Write the output file atomically, unless it would not change.
+
+    The chunks are joined and written to a temporary file in the same
+    directory, which then replaces the output file, so a reader never
+    sees a half written file. The temporary file is synced to the disk
+    before it replaces the output file, so that a crash cannot leave an
+    empty output file behind. If the output file already has exactly
+    this content, it is left alone, so that its modification time does
+    not change and static site generators do not rebuild the page.
+    INPUT:
+    output_file_name -- name of the output file
+    chunks -- iterable of the strings of the output
+    OUTPUT:
+    written -- True if the output file was written, False if it was
+               already up to date
+
+    """
+    # The output is written with utf-8 encoding and Unix newlines.
+    content = ''.join(chunks).encode('utf-8')
+
+    try:
+        mode = os.stat(output_file_name).st_mode & 0o7777
+    except FileNotFoundError:
+        # New files get the usual permissions, not the private ones of
+        # the temporary file.
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    else:
+        # Only read the old file if it could possibly be the same.
+        if os.path.getsize(output_file_name) == len(content):
+            with open(output_file_name, 'rb') as old_file:
+                if old_file.read() == content:
+                    return False
+
+    import tempfile
+    directory, name = os.path.split(os.path.abspath(output_file_name))
+    fd, temp_file_name = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp',
+                                          dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.chmod(temp_file_name, mode)
+        os.replace(temp_file_name, output_file_name)
+    except BaseException:
+        os.remove(temp_file_name)
+        raise
+    return True
+
+
+# Ways to split the output into several files
+SHARD_MODES = ('type', 'year', 'type-year')
+
+
+def shard_references(sort_dict, by):
+    """Split the sorted references into shards, each written to its own file.
+
+    INPUT:
+    sort_dict -- dictionary of sorted references, as returned by
+                 `load_bibtex`
+    by -- 'type' for one shard per section, 'year' for one shard per
+          year, or 'type-year' for one shard per year of each section
+    OUTPUT:
+    shards -- list of (name, group, title, sort_dict) tuples in the
+              order of the index. `name` is used in the file name of
+              the shard, `group` is the heading the shard is listed
+              under in the index, or None, `title` is the text of the
+              link to the shard, and `sort_dict` holds the references
+              in the shard.
+
+    """
+    shards = []
+    if by == 'type':
+        for entrytype, heading in SECTIONS:
+            if entrytype in sort_dict:
+                shards.append((entrytype, None, heading, {entrytype: sort_dict[entrytype]}))
+    elif by == 'year':
+        # The references of each type are sorted by year, so the
+        # references of each year stay sorted.
+        years = {}
+        for entrytype, heading in SECTIONS:
+            for ref in sort_dict.get(entrytype, ()):
+                years.setdefault(ref["year"], {}).setdefault(entrytype, []).append(ref)
+        for year in sorted(years, reverse=True):
+            shards.append((year, None, year, years[year]))
+    elif by == 'type-year':
+        for entrytype, heading in SECTIONS:
+            if entrytype not in sort_dict:
+                continue
+            for year, refs in groupby(sort_dict[entrytype], key=itemgetter("year")):
+                shards.append(('{}-{}'.format(entrytype, year), heading, year,
+                               {entrytype: list(refs)}))
+    else:
+        raise ValueError('Unknown shard mode: {}'.format(by))
+    return shards
+
+
+def shard_file_name(output_file_name, name):
+    """Return the file name of a shard, such as pubs-2016.md for pubs.md."""
+    root, ext = os.path.splitext(output_file_name)
+    return '{}-{}{}'.format(root, name, ext or '.md')
+
+
+def shard_files(output_file_name):
+    """Return the names of the existing files that look like shards of the output.
+
+    These are the files named by `shard_file_name` with the name of a
+    type of reference, a year, or both, like the shards of any of the
+    `SHARD_MODES`. Other files next to the output, like pubs-notes.md
+    for pubs.md, are left out.
+    INPUT:
+    output_file_name -- name of the index file
+    OUTPUT:
+    file_names -- list of the names of the shard files
+
+    """
+    import glob
+    types = '|'.join(re.escape(entrytype) for entrytype in sorted(TEMPLATES))
+    shard_name = re.compile(r'(?:(?:{0})-)?[0-9]+|(?:{0})'.format(types))
+    prefix = shard_file_name(output_file_name, '')
+    root, ext = os.path.splitext(prefix)
+    file_names = []
+    for file_name in glob.glob(glob.escape(root) + '*' + glob.escape(ext)):
+        if shard_name.fullmatch(file_name[len(root):len(file_name) - len(ext)]):
+            file_names.append(file_name)
+    return file_names
+
+
+def format_index(shards, output_file_name, output_format="kramdown"):
+    """Return the index file of the shards, with a link to each shard.
+
+    INPUT:
+    shards -- list of shards, as returned by `shard_references`
+    output_file_name -- name of the index file
+    output_format -- name of the output format in `OUTPUT_FORMATS`. The
+                     index of JSON Lines shards has one object with the
+                     `group`, `title`, and `file` of each shard per line.
+    OUTPUT:
+    index -- the formatted index
 
+    """
+    markup = OUTPUT_FORMATS[output_format]
+    escape = markup.escape or (lambda value: value)
+    index = []
+    group = None
+    for name, shard_group, title, shard in shards:
+        link = os.path.basename(shard_file_name(output_file_name, name))
+        if markup.index_item is None:
+            index.append(json.dumps({'group': shard_group, 'title': title, 'file': link},
+                                    ensure_ascii=False) + '\n')
+            continue
+        if shard_group != group:
+            if index:
+                index.append('\n')
+            index.append(markup.index_group.format(group=escape(shard_group)))
+            group = shard_group
+        index.append(markup.index_item.format(title=escape(title), link=escape(link)))
+    return ''.join(index)
+
+
+def write_shards(output_file_name, sort_dict, render, by, cache=None, keys=None,
+                 output_format="kramdown"):
+    """Write the references split into shards, and an index of the shards.
+
+    With a cache, a shard is only formatted and written again if any of
+    its references changed, or if the file was changed since it was
+    written. Otherwise, a shard is left untouched if its
+    content is the same. The shard files that are not part of this run,
+    see `shard_files`, are deleted with or without a cache.
+    INPUT:
+    output_file_name -- name of the index file. The names of the shards
+                        are derived from it with `shard_file_name`.
+    sort_dict -- dictionary of sorted references, as returned by
+                 `load_bibtex`
+    render -- function that returns the formatted string of a
+              reference
+    by -- how to split the references, one of `SHARD_MODES`
+    cache -- optional `RenderCache` that keeps the digest of each shard
+    keys -- dictionary of the cache key of each reference by its ID,
+            needed with a cache
+    output_format -- name of the output format in `OUTPUT_FORMATS`
 
-def main(argv):
+    """
+    shards = shard_references(sort_dict, by)
+    previous = cache.shards if cache is not None else {}
+    digests = {}
+    for name, group, title, shard in shards:
+        file_name = shard_file_name(output_file_name, name)
+        if cache is not None:
+            digests[name] = output_digest((keys[ref["ID"]] for t in sorted(shard)
+                                           for ref in shard[t]), sections=SECTIONS,
+                                          output_format=output_format)
+            if previous.get(name) == digests[name] and cache.output_unchanged([file_name]):
+                continue
+        write_output(file_name, iter_sections(shard, render, output_format))
+
+    # Remove the shards that no longer have any references, or that
+    # were written with another mode of sharding. The shards in the
+    # cache are removed too, in case their names look like no shard.
+    written = set(shard_file_name(output_file_name, name) for name, group, title, shard in shards)
+    stale = set(shard_files(output_file_name))
+    stale.update(shard_file_name(output_file_name, name) for name in previous)
+    for file_name in sorted(stale - written):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    write_output(output_file_name, [format_index(shards, output_file_name, output_format)])
+    if cache is not None:
+        cache.shards = digests
+        cache.outputs = {}
+        for file_name in sorted(written) + [output_file_name]:
+            cache.record_output(file_name)
+
+
+def _timed_render(render, stats):
+    """Wrap `render` to add the time spent in it to the `render` stage of `stats`.
+
+    The total time spent in `render` is also kept in the `seconds`
+    attribute of the returned function.
+    """
+    def timed_render(ref):
+        start = perf_counter()
+        reference = render(ref)
+        seconds = perf_counter() - start
+        timed_render.seconds += seconds
+        stats.add_time('render', seconds)
+        return reference
+    timed_render.seconds = 0.0
+    return timed_render
+
+
+def load_manifest(manifest_file_name):
+    """Read the list of jobs for the batch mode.
+
+    The manifest is a JSON file with a list of objects, each with the
+    keys `bibfile`, `output`, and optionally `author`. Relative file
+    names are relative to the directory of the manifest.
+    INPUT:
+    manifest_file_name -- name of the manifest file
+    OUTPUT:
+    jobs -- list of (bibfile, author, output) tuples
+
+    """
+    with open(manifest_file_name, 'r', encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    base = os.path.dirname(manifest_file_name)
+    jobs = []
+    for job in manifest:
+        jobs.append((os.path.join(base, job["bibfile"]), job.get("author"),
+                     os.path.join(base, job["output"])))
+    return jobs
+
+
+def run_batch(jobs, processes=1):
+    """Write several output files, parsing each BibTeX file only once.
+
+    Each BibTeX file is parsed and sorted once, and every reference is
+    formatted once without any highlighting. Only the references that
+    include the highlighted author of a job are formatted again for
+    that job.
+    INPUT:
+    jobs -- list of (bibfile, author, output) tuples
+    processes -- number of processes used to format the references
+
+    """
+    parsed = {}
+    for bib_file_name, faname, output_file_name in jobs:
+        if bib_file_name not in parsed:
+            sort_dict = load_bibtex(bib_file_name)
+            refs = [ref for t in section_types() if t in sort_dict for ref in sort_dict[t]]
+            plain = dict(zip((ref["ID"] for ref in refs),
+                             format_references(refs, None, processes)))
+            parsed[bib_file_name] = (sort_dict, plain)
+        sort_dict, plain = parsed[bib_file_name]
+
+        highlighted = sort_dict.ids_of(faname)
+        if faname is not None and not highlighted:
+            warnings.warn("Couldn't find {} in any reference in {}. Sorry!".format(
+                faname, bib_file_name))
+
+        def render(ref):
+            if ref["ID"] not in highlighted:
+                return plain[ref["ID"]]
+            return format_reference(ref, faname)
+
+        write_output(output_file_name, iter_sections(sort_dict, render))
+
+
+def main(argv, stats=None):
+    import argparse
     arg_parser = argparse.ArgumentParser(
         description=(
             "Convert a BibTeX file to kramdown output with optional author highlighting."
@@ -339,8 +2113,12 @@ def main(argv):
         )
     arg_parser.add_argument(
         "-b", "--bibfile",
-        help="Set the filename of the BibTeX reference file.",
-        default="refs.bib",
+        help=(
+            "Set the filenames or glob patterns of the BibTeX reference files. "
+            "The references of several files are merged, dropping duplicates."
+            ),
+        default=["refs.bib"],
+        nargs="+",
         type=str,
         )
     arg_parser.add_argument(
@@ -349,85 +2127,419 @@ def main(argv):
         default="pubs.md",
         type=str,
         )
+    arg_parser.add_argument(
+        "--format",
+        help=(
+            "Set the output formats. With several formats, the BibTeX file is "
+            "parsed once, and the extension of the output file is replaced by "
+            "the extension of each format: .md for kramdown, .markdown for "
+            "markdown, .html for html, and .jsonl for jsonl."
+            ),
+        nargs="+",
+        default=["kramdown"],
+        choices=sorted(OUTPUT_FORMATS),
+        )
     arg_parser.add_argument(
         "-a", "--author",
         help="Set the name of the author to be highlighted.",
         type=str,
         )
+    arg_parser.add_argument(
+        "--only-author",
+        help=(
+            "Only write the references of this author, given like the "
+            "author to be highlighted."
+            ),
+        type=str,
+        )
+    arg_parser.add_argument(
+        "--strict",
+        help=(
+            "Stop with a list of all the invalid references instead of "
+            "leaving them out."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--limit",
+        help="Only write the N newest references of each type.",
+        metavar="N",
+        type=int,
+        )
+    arg_parser.add_argument(
+        "--since",
+        help="Only write the references from this year or later.",
+        metavar="YEAR",
+        type=int,
+        )
+    arg_parser.add_argument(
+        "--stream",
+        help=(
+            "Format each reference as it is read from the BibTeX file, keeping "
+            "only the formatted strings in memory."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--parser",
+        help=(
+            "Set the BibTeX parser. The fast parser handles the BibTeX written "
+            "by Mendeley and Zotero."
+            ),
+        default="bibtexparser",
+        choices=sorted(PARSERS),
+        )
+    arg_parser.add_argument(
+        "--parse-jobs",
+        help=(
+            "Set the number of processes used to parse the BibTeX file. "
+            "The file is memory-mapped and split into chunks of whole entries."
+            ),
+        metavar="N",
+        default=1,
+        type=int,
+        )
+    arg_parser.add_argument(
+        "--snapshot",
+        help=(
+            "Save the parsed references in a hidden file next to the BibTeX "
+            "file, and load them from there instead of parsing the BibTeX file "
+            "again while it does not change."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--no-cache",
+        help=(
+            "Do not use the cache of formatted references stored next to the "
+            "output file."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--clear-cache",
+        help="Empty the cache of formatted references before formatting.",
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--cache-size",
+        help="Set the maximum number of formatted references in the cache.",
+        default=DEFAULT_MAX_ENTRIES,
+        type=int,
+        )
+    arg_parser.add_argument(
+        "-j", "--jobs",
+        help="Set the number of processes used to format the references.",
+        default=1,
+        type=int,
+        )
+    arg_parser.add_argument(
+        "--shard",
+        help=(
+            "Split the output into one file per type of reference, per year, "
+            "or per year of each type, named after the output file, and write "
+            "an index of them to the output file."
+            ),
+        choices=SHARD_MODES,
+        )
+    arg_parser.add_argument(
+        "--manifest",
+        help=(
+            "Set the filename of a JSON list of jobs with the keys bibfile, "
+            "author, and output, to write several output files in one run. "
+            "The --bibfile, --output, and --author options are ignored."
+            ),
+        type=str,
+        )
+    arg_parser.add_argument(
+        "--watch",
+        help=(
+            "Keep running and write the output again whenever the BibTeX file "
+            "changes. Only the changed references are parsed again."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--serve",
+        help=(
+            "Serve the formatted references of the BibTeX file over HTTP, "
+            "highlighting the author given in the author query parameter."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--host",
+        help="Set the address the server listens on.",
+        default="127.0.0.1",
+        type=str,
+        )
+    arg_parser.add_argument(
+        "--port",
+        help="Set the port the server listens on.",
+        default=8000,
+        type=int,
+        )
+    arg_parser.add_argument(
+        "--stats",
+        help=(
+            "Print the time of each stage of the conversion, the number of "
+            "references of each type, and the peak memory to stderr."
+            ),
+        action="store_true",
+        )
+    arg_parser.add_argument(
+        "--profile",
+        help="Print the statistics and the functions that took the most time to stderr.",
+        action="store_true",
+        )
 
     args = arg_parser.parse_args(argv)
-    bib_file_name = args.bibfile
-    output_file_name = args.output
+    if args.stream and len(set(args.format)) > 1:
+        arg_parser.error("--stream can only write one output format")
+    if args.limit is not None and args.limit < 1:
+        arg_parser.error("--limit must be at least 1")
+    patterns = args.bibfile
+    args.bibfile = expand_bib_files(patterns)
+    if not args.bibfile:
+        arg_parser.error("no BibTeX file matches {}".format(' '.join(patterns)))
+    if len(args.bibfile) > 1 and (args.stream or args.watch):
+        arg_parser.error("--stream and --watch can only read one BibTeX file")
+    # The manifest, watch, and serve modes always write every reference
+    # in kramdown to one file, and parse the BibTeX file their own way,
+    # so they cannot be combined with the options that change the
+    # output or how the file is parsed.
+    mode = ("--manifest" if args.manifest is not None else
+            "--watch" if args.watch else "--serve" if args.serve else None)
+    if mode is not None:
+        unsupported = [option for option, used in (
+            ("--format", args.format != ["kramdown"]),
+            ("--strict", args.strict),
+            ("--since", args.since is not None),
+            ("--limit", args.limit is not None),
+            ("--shard", args.shard is not None),
+            ("--only-author", args.only_author is not None),
+            ("--stream", args.stream),
+            ("--snapshot", args.snapshot),
+            ("--parse-jobs", args.parse_jobs != 1),
+            ) if used]
+        if unsupported:
+            arg_parser.error("{} cannot be used with {}".format(
+                ', '.join(unsupported), mode))
+    if args.manifest is not None:
+        run_batch(load_manifest(args.manifest), args.jobs)
+        return
+
+    if args.watch:
+        # Imported here because the watch module imports this module.
+        from bibtextomd.watch import watch
+        watch(args.bibfile[0], args.output, args.author, args.parser)
+        return
+
+    if args.serve:
+        from bibtextomd.server import serve
+        serve(args.bibfile, args.host, args.port, parser=args.parser)
+        return
+
+    # `stats` can also be passed in by applications that want to
+    # collect the statistics themselves.
+    if stats is None and (args.stats or args.profile):
+        stats = Stats()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        convert(args, stats)
+    except InvalidReferenceError as e:
+        arg_parser.exit(1, str(e))
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+    if stats is not None:
+        stats.finish()
+    if args.stats or args.profile:
+        sys.stderr.write(stats.report())
+    if profiler is not None:
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+
+
+def output_file_names(output_file_name, formats):
+    """Return the name of the output file of each output format.
+
+    With one output format, the output file name is used as it is.
+    With several, the extension of the output file name is replaced by
+    the extension of each output format, like pubs.html for pubs.md.
+    """
+    if len(formats) == 1:
+        return [output_file_name]
+    root = os.path.splitext(output_file_name)[0]
+    return [root + OUTPUT_FORMATS[output_format].extension for output_format in formats]
+
+
+def convert(args, stats=None):
+    """Convert the BibTeX files with the options parsed by `main`.
+
+    The BibTeX files are parsed once, merged, and written in each of
+    the output formats in `args.format`.
+    INPUT:
+    args -- the `argparse.Namespace` of the options of `main`
+    stats -- optional `Stats` to add the time of each stage to
+
+    """
+    bib_file_names = args.bibfile
     faname = args.author
+    formats = []
+    for output_format in args.format:
+        if output_format not in formats:
+            formats.append(output_format)
+
+    # Each output file has its own cache of formatted references,
+    # which lives next to it.
+    outputs = []
+    skipped_problems = []
+    for output_format, output_file_name in zip(formats,
+                                               output_file_names(args.output, formats)):
+        cache = source = None
+        if not args.no_cache:
+            cache = RenderCache(cache_file_name(output_file_name), args.cache_size)
+            if args.clear_cache:
+                cache.clear()
+
+            # If the BibTeX file has not been touched since the output
+            # file was written, it does not have to be written again.
+            source = source_digest(bib_file_names, faname, FORMAT_VERSION, SECTIONS,
+                                   {'shard': args.shard, 'only_author': args.only_author,
+                                    'since': args.since, 'limit': args.limit,
+                                    'format': output_format, 'parser': args.parser})
+            if source == cache.source_digest and cache.output_unchanged():
+                skipped_problems = cache.problems
+                continue
+        outputs.append((output_format, output_file_name, cache, source))
+
+    # If none of the output files has to be written, there is no need
+    # to even parse the BibTeX file. The invalid references found when
+    # it was last parsed are still reported.
+    if not outputs:
+        report_problems(skipped_problems, args.strict)
+        return
+
+    if args.stream:
+        # The references are formatted while they are parsed, so there
+        # is only one output format.
+        output_format, output_file_name, cache, source = outputs[0]
+        sort_dict = stream_bibtex(bib_file_names[0], faname, cache, args.jobs, stats,
+                                  args.parser, args.only_author, output_format,
+                                  args.since, args.limit, args.strict)
+        keys = {output_format: dict((ref["ID"], ref["key"]) for refs in sort_dict.values()
+                                    for ref in refs)}
+
+        def make_render(output_format, cache):
+            def render(ref):
+                return ref["reference"]
+            return render
+    else:
+        # With --only-author, the newest references of the author are
+        # only picked after the references of the author are.
+        limit = args.limit if args.only_author is None else None
+        if len(bib_file_names) == 1:
+            sort_dict = load_bibtex(bib_file_names[0], stats, args.parser, args.snapshot,
+                                    args.since, limit, args.strict, args.parse_jobs)
+        else:
+            sort_dict, duplicates = load_bibtex_files(
+                bib_file_names, stats, args.parser, args.snapshot,
+                args.jobs if args.jobs > 1 else None, args.since, limit, args.strict)
+            sys.stderr.write(format_duplicates(duplicates))
+        if args.only_author is not None:
+            sort_dict = sort_dict.by_author(args.only_author, args.limit)
+        start = perf_counter()
+
+        # Look up the references of the highlighted author in the
+        # index. The other references are formatted without any
+        # highlighting, so they share the cache with other authors.
+        highlighted = sort_dict.ids_of(faname)
+        if faname is not None and not highlighted:
+            warnings.warn("Couldn't find {} in any reference in {}. Sorry!".format(
+                faname, ', '.join(bib_file_names)))
+
+        def author_of(ref):
+            return faname if ref["ID"] in highlighted else None
+
+        # The keys of the references in the cache of each output
+        # format, by their IDs.
+        keys = {}
+        if not args.no_cache:
+            for output_format, output_file_name, cache, source in outputs:
+                keys[output_format] = dict(
+                    (ref["ID"], entry_key(ref, author_of(ref), FORMAT_VERSION, output_format))
+                    for refs in sort_dict.values() for ref in refs)
+
+        if stats is not None:
+            stats.add_time('render', perf_counter() - start)
+
+        def make_render(output_format, cache):
+            # Format all the references that are not cached up front,
+            # so that they can be formatted in parallel.
+            formatted = {}
+            format_keys = keys.get(output_format, {})
+            if args.jobs > 1:
+                pending = [ref for t in section_types() if t in sort_dict for ref in sort_dict[t]
+                           if cache is None or format_keys[ref["ID"]] not in cache.entries]
+                for name in set(map(author_of, pending)):
+                    refs = [ref for ref in pending if author_of(ref) == name]
+                    references = format_references(refs, name, args.jobs, output_format)
+                    for ref, reference in zip(refs, references):
+                        formatted[ref["ID"]] = reference
+                        if cache is not None:
+                            cache.set(format_keys[ref["ID"]], reference)
+
+            def render(ref):
+                if ref["ID"] in formatted:
+                    return formatted[ref["ID"]]
+                return format_reference(ref, author_of(ref), cache,
+                                        format_keys.get(ref["ID"]), output_format)
+            return render
+
+    if stats is not None:
+        stats.count(sort_dict)
+
+    for output_format, output_file_name, cache, source in outputs:
+        # If every reference is the same as the last time this output
+        # file was written, there is nothing to do.
+        if cache is not None:
+            digest = output_digest((keys[output_format][ref["ID"]] for t in sorted(sort_dict)
+                                    for ref in sort_dict[t]), args.shard, SECTIONS,
+                                   output_format)
+            cache.problems = sort_dict.problems
+            if digest == cache.output_digest and cache.output_unchanged():
+                cache.source_digest = source
+                cache.save()
+                continue
+            cache.output_digest = digest
+
+        start = perf_counter()
+        render = make_render(output_format, cache)
+        if stats is not None:
+            stats.add_time('render', perf_counter() - start)
+            render = _timed_render(render, stats)
+            start = perf_counter()
+
+        if args.shard is not None:
+            write_shards(output_file_name, sort_dict, render, args.shard, cache,
+                         keys.get(output_format), output_format)
+        else:
+            write_output(output_file_name, iter_sections(sort_dict, render, output_format))
+            if cache is not None:
+                cache.outputs = {}
+                cache.record_output(output_file_name)
+
+        if stats is not None:
+            stats.add_time('write', perf_counter() - start - render.seconds)
 
-    sort_dict = load_bibtex(bib_file_name)
-
-    # Open the output file with utf-8 encoding, write mode, and Unix
-    # newlines.
-    with open(output_file_name, encoding='utf-8', mode='w',
-              newline='') as out_file:
-
-        # Start with journal articles.
-        out_file.write('Journal Articles\n---\n')
-
-        # To get the year numbering correct, we have to set a dummy
-        # value for pubyear (usage described below).
-        pubyear = ''
-
-        # Loop through all the references in the article type. The
-        # logic in this loop (and the loops for the other reference
-        # types) is not amenable to generalization due to different
-        # information for each reference type. Therefore, its easiest
-        # to write out the logic for each loop instead of writing the
-        # logic into a function and calling that.
-        for ref in sort_dict["article"]:
-            # Get the publication year. If the year of the current
-            # reference is not equal to the year of the previous
-            # reference, we need to set `pubyear` equal to `year`.
-            year = ref["year"]
-            if year != pubyear:
-                pubyear = year
-                write_year = '\n{{:.year}}\n### {}\n'.format(year)
-                out_file.write(write_year)
-
-            out_file.write(journal_article(ref, faname))
-
-        # Next are conference papers and posters.
-        out_file.write('\nConference Publications and Posters\n---\n')
-
-        # Same trick for the pubyear as for the journal articles.
-        pubyear = ''
-
-        # Loop through the references in the `inproceedings` type.
-        for ref in sort_dict["inproceedings"]:
-            year = ref["year"]
-            if year != pubyear:
-                pubyear = year
-                write_year = '\n{{:.year}}\n### {}\n'.format(year)
-                out_file.write(write_year)
-
-            out_file.write(in_proceedings(ref, faname))
-
-        # Finally are the theses and dissertations. Same general logic
-        # as for the other reference types.
-        pubyear = ''
-        for ref in sort_dict["phdthesis"]:
-            out_file.write("\nPh.D. Dissertation\n---\n\n")
-            year = ref["year"]
-            if year != pubyear:
-                pubyear = year
-                write_year = '{{:.year}}\n### {}\n'.format(year)
-                out_file.write(write_year)
-
-            out_file.write(thesis(ref, faname))
-
-        pubyear = ''
-        for ref in sort_dict["mastersthesis"]:
-            out_file.write("\nMaster's Thesis\n---\n\n")
-            year = ref["year"]
-            if year != pubyear:
-                pubyear = year
-                write_year = '{{:.year}}\n### {}\n'.format(year)
-                out_file.write(write_year)
-
-            out_file.write(thesis(ref, faname))
+        if cache is not None:
+            cache.source_digest = source
+            cache.save()
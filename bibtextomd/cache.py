@@ -0,0 +1,236 @@
+"""
+On-disk cache of formatted references
+"""
+# System imports
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+# Version of the layout of the cache file. A cache file with a
+# different version is ignored.
+CACHE_VERSION = 3
+
+# Default maximum number of formatted references kept in the cache.
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def cache_file_name(output_file_name):
+    """Return the name of the cache file for `output_file_name`.
+
+    The cache is stored as a hidden file next to the output file, so
+    that every output file has its own cache.
+    """
+    head, tail = os.path.split(output_file_name)
+    return os.path.join(head, '.' + tail + '.cache')
+
+
+def entry_key(ref, faname, format_version, output_format="kramdown"):
+    """Return a hash of the content of a reference.
+
+    INPUT:
+    ref -- dictionary of the fields of the reference
+    faname -- string of the initialized name of the author to whom
+              formatting will be applied
+    format_version -- version of the formatters, so that cached
+                      references are re-formatted when the formatting
+                      changes
+    output_format -- name of the output format the reference is
+                     formatted in
+    OUTPUT:
+    key -- hex digest identifying the formatted reference
+
+    """
+    # Hash the fields as they were parsed if the reference keeps them,
+    # so that hashing does not convert every field to unicode.
+    fields = getattr(ref, 'raw', ref)
+    content = json.dumps([sorted(fields.items()), faname, format_version, output_format],
+                         ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def output_digest(keys, layout=None, sections=None, output_format="kramdown"):
+    """Return a hash of the keys of all the references in an output file.
+
+    INPUT:
+    keys -- iterable of the keys of the references, as returned by
+            `entry_key`
+    layout -- how the output is split into files, or None if it is
+              written to one file
+    sections -- list of the (type of reference, heading) sections of
+                the output, which decide which references are written
+                and under which headings
+    output_format -- name of the output format of the file
+    OUTPUT:
+    digest -- hex digest of the output
+
+    """
+    digest = hashlib.sha256()
+    digest.update('{}\n'.format(output_format).encode('utf-8'))
+    if layout is not None:
+        digest.update('{}\n'.format(layout).encode('utf-8'))
+    if sections is not None:
+        digest.update('{}\n'.format(json.dumps(sections, ensure_ascii=False)).encode('utf-8'))
+    for key in keys:
+        digest.update(key.encode('ascii'))
+    return digest.hexdigest()
+
+
+def source_digest(bib_file_name, faname, format_version, sections, options=None):
+    """Return a hash of everything the output file depends on.
+
+    The BibTeX files are identified by their names, sizes, and
+    modification times, so this does not need to read them.
+    INPUT:
+    bib_file_name -- name of the BibTeX file, or list of the names of
+                     the BibTeX files
+    faname -- string of the initialized name of the highlighted author
+    format_version -- version of the formatters
+    sections -- list of the (type of reference, heading) sections
+    options -- dictionary of any other options the output depends on
+    OUTPUT:
+    digest -- hex digest, or None if a BibTeX file does not exist
+
+    """
+    if isinstance(bib_file_name, str):
+        bib_file_names = [bib_file_name]
+    else:
+        bib_file_names = bib_file_name
+
+    files = []
+    for name in bib_file_names:
+        try:
+            stat = os.stat(name)
+        except OSError:
+            return None
+        files.extend([os.path.abspath(name), stat.st_size, stat.st_mtime_ns])
+
+    content = json.dumps(files + [faname, format_version, sections, options],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def file_stat(file_name):
+    """Return the [size, modification time] of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class RenderCache(object):
+    """Map the hash of a reference to its formatted string.
+
+    The least recently used references are evicted when the cache
+    holds more than `max_entries` references. The cache also stores
+    the digest of the last output file that was written and of the
+    BibTeX file it was written from, so that the output can be left
+    alone when nothing has changed, the digest of each shard when the
+    output is split into several files, and the invalid references that
+    were left out, so they are reported again when nothing has changed.
+    The size and modification time of each file that was written are
+    kept too, so that an output file that was changed by anything else
+    is written again.
+    """
+
+    def __init__(self, file_name, max_entries=DEFAULT_MAX_ENTRIES):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.output_digest = None
+        self.source_digest = None
+        self.shards = {}
+        self.outputs = {}
+        self.problems = []
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """Read the cache file, ignoring it if it is missing or invalid."""
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return
+
+        self.entries = OrderedDict(data['entries'])
+        self.output_digest = data['output_digest']
+        self.source_digest = data.get('source_digest')
+        self.shards = data.get('shards', {})
+        self.outputs = data.get('outputs', {})
+        self.problems = [tuple(problem) for problem in data.get('problems', [])]
+
+    def save(self):
+        """Evict the least recently used references and write the cache file."""
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        data = {
+            'version': CACHE_VERSION,
+            'output_digest': self.output_digest,
+            'source_digest': self.source_digest,
+            'shards': self.shards,
+            'outputs': self.outputs,
+            'problems': self.problems,
+            'entries': list(self.entries.items()),
+        }
+        with open(self.file_name, 'w', encoding='utf-8') as cache_file:
+            json.dump(data, cache_file, ensure_ascii=False)
+
+    def clear(self):
+        """Remove all the references from the cache and delete the cache file."""
+        self.entries.clear()
+        self.output_digest = None
+        self.source_digest = None
+        self.shards = {}
+        self.outputs = {}
+        self.problems = []
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    def record_output(self, file_name):
+        """Remember the size and modification time of a file that was just written."""
+        self.outputs[os.path.abspath(file_name)] = file_stat(file_name)
+
+    def output_unchanged(self, file_names=None):
+        """Return whether the files are still the ones that were written with this cache.
+
+        INPUT:
+        file_names -- names of the files to check. Defaults to all the
+                      files that were written.
+        OUTPUT:
+        unchanged -- False if any of the files is gone, was never
+                     written with this cache, or was changed since
+
+        """
+        if file_names is None:
+            file_names = list(self.outputs)
+        if not file_names:
+            return False
+        for file_name in file_names:
+            stat = self.outputs.get(os.path.abspath(file_name))
+            if stat is None or file_stat(file_name) != stat:
+                return False
+        return True
+
+    def get(self, key):
+        """Return the formatted reference for `key`, or None if it is not cached."""
+        try:
+            reference = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return reference
+
+    def set(self, key, reference):
+        """Store the formatted reference for `key`."""
+        self.entries[key] = reference
+        self.entries.move_to_end(key)
@@ -0,0 +1,173 @@
+"""
+A small BibTeX tokenizer for the files that Mendeley and Zotero write
+
+This handles braced and quoted values, bare numbers, `@string` macros
+(including the month macros, which are kept as they are unless they are
+defined), and `#` concatenation. The values are cleaned up the same way
+`bibtexparser` cleans them up, so both parsers give the same entries
+for these files.
+"""
+# System imports
+import re
+
+# Entry types that bibtexparser keeps. Other types are skipped.
+STANDARD_TYPES = frozenset([
+    'article', 'book', 'booklet', 'conference', 'inbook', 'incollection',
+    'inproceedings', 'manual', 'mastersthesis', 'misc', 'phdthesis',
+    'proceedings', 'techreport', 'unpublished',
+])
+
+# Field names that bibtexparser renames
+ALIASES = {
+    'keyw': 'keyword',
+    'keywords': 'keyword',
+    'authors': 'author',
+    'editors': 'editor',
+    'url': 'link',
+    'urls': 'link',
+    'links': 'link',
+    'subjects': 'subject',
+}
+
+HEAD_RE = re.compile(r'@\s*([^\s{(]+)\s*[{(]')
+FIELD_RE = re.compile(r'[\s,]*([^\s=,{}()"#]+)\s*=\s*')
+BARE_RE = re.compile(r'[^\s,#{}()"]+')
+SPACE_RE = re.compile(r'\s*')
+BRACES_RE = re.compile(r'[{}]')
+QUOTES_RE = re.compile(r'[{}"]')
+# bibtexparser splits records into fields at a comma at the end of a
+# line and joins the parts of a value with ', ' again
+LINE_COMMA_RE = re.compile(r',\s*\n|\n\s*,')
+
+
+class BibTeXSyntaxError(ValueError):
+    """Raised when a record cannot be tokenized."""
+
+
+def _braced(text, pos):
+    """Return the content of the braces starting at `pos` and the position after them."""
+    # Only look at the braces, so the text between them is skipped by
+    # the regular expression engine.
+    depth = 0
+    for match in BRACES_RE.finditer(text, pos):
+        if match.group() == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return text[pos + 1:match.start()], match.end()
+    raise BibTeXSyntaxError('Unbalanced braces in {!r}'.format(text[pos:pos + 40]))
+
+
+def _quoted(text, pos):
+    """Return the content of the quotes starting at `pos` and the position after them."""
+    depth = 0
+    for match in QUOTES_RE.finditer(text, pos + 1):
+        char = match.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif depth == 0:
+            return text[pos + 1:match.start()], match.end()
+    raise BibTeXSyntaxError('Unterminated quotes in {!r}'.format(text[pos:pos + 40]))
+
+
+def _full_span(value):
+    """Return True if `value` is one group of braces, like `{...}`."""
+    if not (value.startswith('{') and value.endswith('}')):
+        return False
+    try:
+        content, end = _braced(value, 0)
+    except BibTeXSyntaxError:
+        return False
+    return end == len(value)
+
+
+def _value(text, pos, strings):
+    """Tokenize the value starting at `pos`, and return it and the position after it."""
+    pieces = []
+    while True:
+        pos = SPACE_RE.match(text, pos).end()
+        char = text[pos:pos + 1]
+        if char == '{':
+            piece, pos = _braced(text, pos)
+        elif char == '"':
+            piece, pos = _quoted(text, pos)
+        else:
+            match = BARE_RE.match(text, pos)
+            if match is None:
+                raise BibTeXSyntaxError('Expected a value in {!r}'.format(text[pos:pos + 40]))
+            piece = match.group()
+            piece = strings.get(piece.lower(), piece)
+            pos = match.end()
+        pieces.append(piece)
+
+        pos = SPACE_RE.match(text, pos).end()
+        if text[pos:pos + 1] != '#':
+            break
+        pos += 1
+
+    value = ''.join(pieces)
+    if '\n' in value:
+        value = LINE_COMMA_RE.sub(', ', value)
+    # bibtexparser strips one more level of braces around the value,
+    # and substitutes values that are the name of a macro.
+    if _full_span(value):
+        value = value[1:-1]
+    return strings.get(value.lower(), value), pos
+
+
+def record_parser():
+    """Return a function that parses one BibTeX record.
+
+    The returned function takes the string of one record, starting with
+    `@`, and returns a list of dicts of the key, value pairs of the
+    entries in it, in the same format as `bibtexparser`. `@string`
+    macros are remembered and applied to the records parsed after them.
+    """
+    strings = {}
+
+    def parse_record(record):
+        match = HEAD_RE.match(record)
+        if match is None:
+            return []
+        entrytype = match.group(1).lower()
+        if entrytype in ('comment', 'preamble'):
+            return []
+
+        # Like bibtexparser, strip the whitespace around each line
+        text = '\n'.join(line.strip() for line in record.split('\n'))
+        pos = HEAD_RE.match(text).end()
+
+        if entrytype == 'string':
+            field = FIELD_RE.match(text, pos)
+            if field is None:
+                return []
+            value, pos = _value(text, field.end(), strings)
+            strings[field.group(1).lower()] = value
+            return []
+
+        if entrytype not in STANDARD_TYPES:
+            return []
+
+        comma = text.find(',', pos)
+        if comma < 0:
+            return []
+        entry = {}
+        pos = comma + 1
+        while True:
+            field = FIELD_RE.match(text, pos)
+            if field is None:
+                break
+            value, pos = _value(text, field.end(), strings)
+            name = field.group(1).lower()
+            entry[ALIASES.get(name, name)] = value
+
+        if not entry:
+            return []
+        entry['ENTRYTYPE'] = entrytype
+        entry['ID'] = text[HEAD_RE.match(text).end():comma].strip()
+        return [entry]
+
+    return parse_record
@@ -0,0 +1,121 @@
+"""
+Parsing large BibTeX files in several processes
+"""
+# System imports
+import io
+import mmap
+import os
+import re
+
+# Local imports
+from bibtextomd.bib import iter_records, record_parser
+
+# Number of chunks per process, so that a process that gets a chunk with
+# long records does not hold up the others.
+CHUNKS_PER_JOB = 4
+
+# The start of a record: a line whose first character that is not
+# whitespace is `@`, the same rule as `iter_records`. The match starts
+# at the newline before the record.
+RECORD_START_RE = re.compile(rb'\n[ \t\r\f\v]*@')
+
+# The start of an `@string` record, which may be preceded by a
+# byte-order mark on the first line of the file. Records that are not
+# really `@string` macros may match too, which is harmless, because the
+# entries of these records are thrown away.
+STRING_RE = re.compile(rb'(?im)^(?:\xef\xbb\xbf)?[ \t\r\f\v]*@\s*string\s*[{(]')
+
+
+def record_end(mm, pos):
+    """Return the offset of the start of the first record after `pos`, or the end of the file."""
+    match = RECORD_START_RE.search(mm, pos)
+    if match is None:
+        return len(mm)
+    return match.start() + 1
+
+
+def chunk_offsets(mm, chunks):
+    """Split a memory-mapped BibTeX file into about `chunks` chunks of whole records.
+
+    INPUT:
+    mm -- the memory-mapped BibTeX file
+    chunks -- the number of chunks to split it into
+    OUTPUT:
+    offsets -- list of the (start, end) offsets of each chunk. Each
+               chunk but the first starts at the start of a record, so
+               it has the same records as the serial parse.
+
+    """
+    size = len(mm)
+    starts = [0]
+    for i in range(1, chunks):
+        start = record_end(mm, max(size * i // chunks, starts[-1]))
+        if start >= size:
+            break
+        if start > starts[-1]:
+            starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def string_records(mm):
+    """Return the (start, text) of each `@string` record of a memory-mapped BibTeX file."""
+    records = []
+    for match in STRING_RE.finditer(mm):
+        start = match.start()
+        records.append((start, mm[start:record_end(mm, match.end())].decode('utf-8')))
+    return records
+
+
+def _parse_chunk(item):
+    """Parse the records in one chunk of a BibTeX file, in a worker process."""
+    bib_file_name, start, end, strings, parser = item
+    parse_record = record_parser(parser)
+    # Parse the `@string` macros defined before the chunk first, so
+    # that they are applied to its entries the same way as when the
+    # whole file is parsed at once.
+    for text in strings:
+        for entry in iter_records(io.StringIO(text, newline=None), parse_record):
+            pass
+
+    with open(bib_file_name, 'rb') as bib_file:
+        with mmap.mmap(bib_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode('utf-8')
+    # Translate the line endings like a file opened in text mode.
+    return list(iter_records(io.StringIO(text, newline=None), parse_record))
+
+
+def parse_parallel(bib_file_name, jobs, parser="bibtexparser"):
+    """Parse a BibTeX file in chunks in `jobs` processes.
+
+    The file is memory-mapped and split into chunks at the start of
+    records, and each chunk is parsed in a worker process, which maps
+    the file again to read its chunk. The `@string` macros defined
+    before each chunk are sent along with it.
+    INPUT:
+    bib_file_name -- name of the BibTeX file
+    jobs -- number of processes
+    parser -- name of the parser backend in `PARSERS`
+    OUTPUT:
+    refs -- list of the `Reference`s of all the entries, in the same
+            order as `iter_bibtex` yields them
+
+    """
+    if os.path.getsize(bib_file_name) == 0:
+        # An empty file cannot be memory-mapped.
+        return []
+
+    with open(bib_file_name, 'rb') as bib_file:
+        with mmap.mmap(bib_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = chunk_offsets(mm, jobs * CHUNKS_PER_JOB)
+            strings = string_records(mm)
+
+    items = [(bib_file_name, start, end,
+              [text for string_start, text in strings if string_start < start], parser)
+             for start, end in offsets]
+    if len(items) == 1:
+        chunks = [_parse_chunk(items[0])]
+    else:
+        from multiprocessing import Pool
+        with Pool(min(jobs, len(items))) as pool:
+            chunks = pool.map(_parse_chunk, items)
+    return [ref for chunk in chunks for ref in chunk]
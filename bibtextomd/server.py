@@ -0,0 +1,283 @@
+"""
+Serve the formatted references of BibTeX files over HTTP
+"""
+# System imports
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+import asyncio
+import os
+import sys
+import threading
+
+# Local imports
+from bibtextomd.bib import load_bibtex, render
+from bibtextomd.watch import file_signature
+
+# Maximum number of formatted pages kept in memory
+DEFAULT_MAX_PAGES = 128
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+def page_name(bib_file_name):
+    """Return the name a BibTeX file is served under, its name without the extension."""
+    return os.path.splitext(os.path.basename(bib_file_name))[0]
+
+
+def page_names(bib_file_names):
+    """Return the names a list of BibTeX files are served under.
+
+    Each file is served under its name without the extension. If two
+    files have the same name, like `a/refs.bib` and `b/refs.bib`, all
+    the files are served under their path from the directory they have
+    in common instead, like `a/refs` and `b/refs`.
+    """
+    names = [page_name(bib_file_name) for bib_file_name in bib_file_names]
+    if len(set(names)) == len(names):
+        return names
+
+    paths = [os.path.abspath(bib_file_name) for bib_file_name in bib_file_names]
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = [os.path.splitext(os.path.relpath(path, common))[0].replace(os.sep, '/')
+             for path in paths]
+    if len(set(names)) != len(names):
+        raise ValueError('The same BibTeX file is given more than once')
+    return names
+
+
+class Library(object):
+    """Keep the references of a set of BibTeX files and their formatted pages in memory.
+
+    Each BibTeX file is parsed and sorted when it is first needed, and
+    again only when its modification time or size changes. The
+    formatted page of each (BibTeX file, author) pair is kept until the
+    BibTeX file changes, and the least recently used pages are dropped
+    when there are more than `max_pages` of them. Only the BibTeX files
+    given here can be served. The pages are made in the threads of the
+    event loop's executor, so a lock guards the parsed references and
+    the pages.
+    """
+
+    def __init__(self, bib_file_names, max_pages=DEFAULT_MAX_PAGES, parser="bibtexparser"):
+        #: Dictionary of the name of each BibTeX file by its page name
+        self.bib_files = OrderedDict(zip(page_names(bib_file_names), bib_file_names))
+        self.lock = threading.Lock()
+        self.max_pages = max_pages
+        self.parser = parser
+        self.parsed = {}
+        self.pages = OrderedDict()
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, name):
+        """Return the signature and the sorted references of a BibTeX file.
+
+        INPUT:
+        name -- the page name of the BibTeX file
+        OUTPUT:
+        signature -- the modification time and size of the BibTeX file
+        sort_dict -- dictionary of sorted references, as returned by
+                     `load_bibtex`
+
+        """
+        bib_file_name = self.bib_files[name]
+        signature = file_signature(bib_file_name)
+        if signature is None:
+            raise KeyError(name)
+
+        parsed = self.parsed.get(name)
+        if parsed is None or parsed[0] != signature:
+            parsed = (signature, load_bibtex(bib_file_name, parser=self.parser))
+            self.parsed[name] = parsed
+            self.loads += 1
+        return parsed
+
+    def page(self, name, author=None):
+        """Return the formatted references of a BibTeX file as utf-8 bytes.
+
+        INPUT:
+        name -- the page name of the BibTeX file
+        author -- string of the initialized name of the author to whom
+                  formatting will be applied
+        OUTPUT:
+        page -- the formatted references
+
+        """
+        with self.lock:
+            return self._page(name, author)
+
+    def cached_page(self, name, author=None):
+        """Return the page if it is cached and the BibTeX file did not change, or None.
+
+        This never parses or formats, and does not wait for the lock, so
+        it can be called from the event loop.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            key = (name, author)
+            cached = self.pages.get(key)
+            if cached is None or cached[0] != file_signature(self.bib_files[name]):
+                return None
+            self.hits += 1
+            self.pages.move_to_end(key)
+            return cached[1]
+        finally:
+            self.lock.release()
+
+    def _page(self, name, author):
+        signature, sort_dict = self.load(name)
+        key = (name, author)
+        cached = self.pages.get(key)
+        if cached is not None and cached[0] == signature:
+            self.hits += 1
+            self.pages.move_to_end(key)
+            return cached[1]
+
+        self.misses += 1
+        page = ''.join(render(sort_dict, author=author)).encode('utf-8')
+        self.pages[key] = (signature, page)
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+        return page
+
+    def respond(self, method, target, cached_only=False):
+        """Return the status, content type, and body of the response to a request.
+
+        `/` lists the page names of the BibTeX files, and `/name` or
+        `/name.md` returns the formatted references of one BibTeX file.
+        The highlighted author is given as the `author` query
+        parameter, like `/refs?author=F.A. Author`. With `cached_only`,
+        None is returned instead if the page is not cached.
+        """
+        if method not in ('GET', 'HEAD'):
+            return 405, 'text/plain', b'Only GET and HEAD are supported\n'
+
+        url = urlsplit(target)
+        name = unquote(url.path).strip('/')
+        if name.endswith('.md'):
+            name = name[:-3]
+        if not name:
+            listing = ''.join('{}\n'.format(name) for name in self.bib_files)
+            return 200, 'text/plain; charset=utf-8', listing.encode('utf-8')
+        if name not in self.bib_files:
+            return 404, 'text/plain', b'Not found\n'
+
+        author = parse_qs(url.query).get('author', [None])[0]
+        try:
+            if cached_only:
+                page = self.cached_page(name, author)
+                if page is None:
+                    return None
+            else:
+                page = self.page(name, author)
+        except KeyError:
+            return 404, 'text/plain', b'Not found\n'
+        except Exception as e:
+            sys.stderr.write('Error formatting {}: {!r}\n'.format(name, e))
+            return 500, 'text/plain', b'Internal server error\n'
+        return 200, 'text/markdown; charset=utf-8', page
+
+    async def handle(self, reader, writer):
+        """Answer the HTTP requests on one connection.
+
+        Cached pages are answered right away, and the other pages are
+        parsed and formatted in the executor of the event loop, so a
+        large BibTeX file does not hold up the other connections.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    header, _, value = line.decode('latin-1').partition(':')
+                    headers[header.strip().lower()] = value.strip()
+
+                # Skip the body of the request, so the next request on
+                # the connection is read from its start.
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length > 0:
+                    await reader.readexactly(length)
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3 or length < 0:
+                    status, content_type, body = 400, 'text/plain', b'Bad request\n'
+                    method, version = 'GET', 'HTTP/1.0'
+                else:
+                    method, target, version = parts
+                    response = self.respond(method, target, cached_only=True)
+                    if response is None:
+                        response = await loop.run_in_executor(
+                            None, self.respond, method, target)
+                    status, content_type, body = response
+
+                # HTTP/1.1 connections stay open unless the client
+                # asks to close them.
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                head = ('HTTP/1.1 {} {}\r\n'
+                        'Content-Type: {}\r\n'
+                        'Content-Length: {}\r\n'
+                        'Connection: {}\r\n'
+                        '\r\n').format(status, REASONS[status], content_type, len(body),
+                                       'keep-alive' if keep_alive else 'close')
+                writer.write(head.encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def serve(bib_file_names, host='127.0.0.1', port=8000, max_pages=DEFAULT_MAX_PAGES,
+          parser="bibtexparser"):
+    """Serve the formatted references of BibTeX files until interrupted with Ctrl-C.
+
+    INPUT:
+    bib_file_names -- list of the names of the BibTeX files to serve
+    host -- the address to listen on
+    port -- the port to listen on
+    max_pages -- maximum number of formatted pages kept in memory
+    parser -- name of the parser backend in `PARSERS`
+
+    """
+    library = Library(bib_file_names, max_pages, parser)
+    # Parse the BibTeX files up front so the first requests are fast.
+    for name in library.bib_files:
+        library.load(name)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_server(library.handle, host, port))
+    sys.stderr.write('Serving {} on http://{}:{}/\n'.format(
+        ', '.join(library.bib_files), host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
@@ -0,0 +1,108 @@
+"""
+Snapshots of parsed BibTeX files, so unchanged files do not have to be parsed again
+"""
+# System imports
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Version of the layout of the snapshot file. A snapshot with a
+# different version is ignored.
+SNAPSHOT_VERSION = 3
+
+
+def snapshot_file_name(bib_file_name):
+    """Return the name of the snapshot file for `bib_file_name`.
+
+    The snapshot is stored as a hidden file next to the BibTeX file.
+    """
+    head, tail = os.path.split(bib_file_name)
+    return os.path.join(head, '.' + tail + '.snapshot')
+
+
+def file_hash(file_name):
+    """Return the sha256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_snapshot(bib_file_name, parser):
+    """Return the references saved in the snapshot of a BibTeX file.
+
+    The snapshot is only used if it was written by the same `parser`
+    and the BibTeX file has the same size and modification time as
+    when the snapshot was written. If only the modification time is
+    different, the content of the BibTeX file is compared by its hash,
+    so a file that was touched or copied does not have to be parsed
+    again.
+    INPUT:
+    bib_file_name -- name of the BibTeX file
+    parser -- name of the parser backend
+    OUTPUT:
+    references -- the saved references, or None if there is no valid
+                  snapshot
+
+    """
+    try:
+        stat = os.stat(bib_file_name)
+        snapshot_file = open(snapshot_file_name(bib_file_name), 'rb')
+    except OSError:
+        return None
+
+    with snapshot_file:
+        try:
+            header = pickle.load(snapshot_file)
+            if (not isinstance(header, dict) or
+                    header.get('version') != SNAPSHOT_VERSION or
+                    header['parser'] != parser or header['size'] != stat.st_size):
+                return None
+            if (header['mtime_ns'] != stat.st_mtime_ns and
+                    header['sha256'] != file_hash(bib_file_name)):
+                return None
+            return pickle.load(snapshot_file)
+        except Exception:
+            # A truncated or otherwise broken snapshot is ignored.
+            return None
+
+
+def write_snapshot(bib_file_name, parser, references, stat):
+    """Save the parsed references of a BibTeX file next to it.
+
+    The snapshot is not written if the BibTeX file changed since it was
+    parsed.
+    INPUT:
+    bib_file_name -- name of the BibTeX file
+    parser -- name of the parser backend
+    references -- the references to save, as returned by `load_bibtex`
+    stat -- `os.stat` of the BibTeX file from before it was parsed
+
+    """
+    sha256 = file_hash(bib_file_name)
+    now = os.stat(bib_file_name)
+    if (now.st_size, now.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return
+
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'parser': parser,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256,
+    }
+    # Write to a temporary file first, so another process never reads
+    # half of a snapshot.
+    file_name = snapshot_file_name(bib_file_name)
+    directory, name = os.path.split(os.path.abspath(file_name))
+    fd, temp_file_name = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            pickle.dump(header, snapshot_file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(references, snapshot_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        os.remove(temp_file_name)
+        raise
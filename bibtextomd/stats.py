@@ -0,0 +1,121 @@
+"""
+Timing and counting the stages of a conversion
+"""
+# System imports
+from collections import OrderedDict
+from contextlib import contextmanager
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+class Stats(object):
+    """Collect the wall time of each stage of a conversion.
+
+    The stages are `read` (reading the BibTeX file), `parse`
+    (`BibTexParser`), `sort`, `render` (formatting the references), and
+    `write` (writing the output). The fields of the references are
+    converted to unicode when they are first used, so that time is
+    part of the stage that uses them first. Each
+    function in `hooks` is called with the name of the stage and the
+    time in seconds whenever the time of a stage is added, so that
+    applications can collect the timings as they happen.
+    """
+
+    def __init__(self):
+        self.times = OrderedDict()
+        self.counts = OrderedDict()
+        self.hooks = []
+        self.start = time.perf_counter()
+        self.total = None
+        self.peak_memory = None
+
+    def add_time(self, stage, seconds):
+        """Add `seconds` to the time spent in `stage`."""
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        for hook in self.hooks:
+            hook(stage, seconds)
+
+    @contextmanager
+    def stage(self, stage):
+        """Context manager that adds the time spent in its block to `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, sort_dict):
+        """Count the references of each type in `sort_dict`."""
+        for entrytype, refs in sorted(sort_dict.items()):
+            self.counts[entrytype] = self.counts.get(entrytype, 0) + len(refs)
+
+    def finish(self):
+        """Record the total time and the peak memory of the conversion."""
+        self.total = time.perf_counter() - self.start
+        self.peak_memory = peak_memory()
+
+    @property
+    def entries(self):
+        return sum(self.counts.values())
+
+    def as_dict(self):
+        """Return the collected statistics as a dictionary."""
+        return {
+            'times': dict(self.times),
+            'total': self.total,
+            'entries': self.entries,
+            'entries_per_second': self.entries / self.total if self.total else None,
+            'counts': dict(self.counts),
+            'peak_memory': self.peak_memory,
+        }
+
+    def report(self):
+        """Return a human readable report of the collected statistics."""
+        lines = ['{:<10} {:>10}'.format('stage', 'time (s)')]
+        for stage, seconds in self.times.items():
+            lines.append('{:<10} {:>10.4f}'.format(stage, seconds))
+        if self.total is not None:
+            lines.append('{:<10} {:>10.4f}'.format('total', self.total))
+            if self.total > 0:
+                lines.append('entries: {} ({:.1f} per second)'.format(
+                    self.entries, self.entries / self.total))
+        for entrytype, count in self.counts.items():
+            lines.append('  {}: {}'.format(entrytype, count))
+        if self.peak_memory is not None:
+            lines.append('peak memory: {:.1f} MB'.format(self.peak_memory / 2**20))
+        return '\n'.join(lines) + '\n'
+
+
+def timed_iter(iterable, stats, stage):
+    """Yield the items of `iterable`, adding the time to get them to `stage`."""
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds += time.perf_counter() - start
+                return
+            seconds += time.perf_counter() - start
+            yield item
+    finally:
+        stats.add_time(stage, seconds)
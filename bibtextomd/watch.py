@@ -0,0 +1,214 @@
+"""
+Re-render the output whenever the BibTeX file changes
+"""
+# System imports
+import os
+import sys
+import time
+
+# Package imports
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    # Without inotify_simple the BibTeX file is polled for changes
+    INotify = None
+
+# Local imports
+from bibtextomd.bib import (record_parser, iter_records, sort_references, format_reference,
+                            format_section, write_output, validate_references,
+                            report_problems, SECTIONS)
+
+
+def file_signature(file_name):
+    """Return the modification time and size of a file, or None if it is missing."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def poll_for_change(file_name, interval=0.5, signature=None):
+    """Block until the modification time or the size of `file_name` changes.
+
+    The change is from `signature`, as returned by `file_signature`, or
+    by default from the signature of the file when this is called.
+    """
+    if signature is None:
+        signature = file_signature(file_name)
+    while file_signature(file_name) == signature:
+        time.sleep(interval)
+
+
+class ChangeMonitor(object):
+    """Notice the changes of a file from the time the monitor is made.
+
+    Make the monitor before reading the file, so that a change saved
+    while the file is read is not missed. Uses inotify if it is
+    available, and watches the directory of the file, because many
+    editors and sync tools replace the file instead of writing to it.
+    Otherwise the file is checked for changes every `interval` seconds.
+    """
+
+    def __init__(self, file_name, interval=0.5):
+        self.file_name = file_name
+        self.interval = interval
+        self.signature = file_signature(file_name)
+        self.inotify = None
+        if INotify is not None and sys.platform.startswith('linux'):
+            directory, self.name = os.path.split(os.path.abspath(file_name))
+            self.inotify = INotify()
+            self.inotify.add_watch(directory,
+                                   flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+
+    def wait(self):
+        """Block until the file changed, then stop watching it."""
+        try:
+            if self.inotify is None:
+                poll_for_change(self.file_name, self.interval, self.signature)
+                return
+            # The events since the monitor was made are queued, so a
+            # change before this is called is seen right away.
+            while True:
+                for event in self.inotify.read():
+                    if event.name == self.name:
+                        return
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop watching the file."""
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def wait_for_change(file_name, interval=0.5):
+    """Block until `file_name` changes, with inotify if it is available."""
+    ChangeMonitor(file_name, interval).wait()
+
+
+class Watcher(object):
+    """Keep the parsed and formatted references between rebuilds.
+
+    Each rebuild reads the BibTeX file again, but only parses the
+    records whose text changed, and only formats the sections of the
+    output whose references changed.
+    """
+
+    def __init__(self, bib_file_name, output_file_name, faname=None, parser="bibtexparser"):
+        self.bib_file_name = bib_file_name
+        self.output_file_name = output_file_name
+        self.faname = faname
+        self.parser = parser
+        # Map from (macros, text of the record) to the parsed entries
+        self.records = {}
+        # Map from the type of reference to the references and the
+        # formatted section
+        self.sections = {}
+        self.output = None
+        #: Number of records parsed and sections formatted in the last
+        #: rebuild
+        self.parsed = 0
+        self.formatted = 0
+
+    def parse(self):
+        """Parse the BibTeX file, reusing the entries of unchanged records."""
+        parse_record = record_parser(self.parser)
+        records = {}
+        # The entries of a record depend on the @string macros defined
+        # before it, so they are part of the key of the record.
+        macros = [None]
+
+        def parse_cached(record):
+            if record[:7].lower() == '@string':
+                macros[0] = hash((macros[0], record))
+                return parse_record(record)
+
+            key = (macros[0], record)
+            if key in self.records:
+                refs = self.records[key]
+            else:
+                refs = parse_record(record)
+                self.parsed += 1
+            records[key] = refs
+            return refs
+
+        refsdict = {}
+        with open(self.bib_file_name, 'r', encoding='utf-8') as bib_file:
+            for ref in iter_records(bib_file, parse_cached):
+                refsdict[ref["ID"]] = ref
+
+        # Only keep the records that are still in the file
+        self.records = records
+        # An invalid reference is left out with a warning, instead of
+        # stopping the watch.
+        problems = validate_references(refsdict)
+        report_problems([(self.bib_file_name, ID, problem) for ID, problem in problems])
+        return sort_references(refsdict)
+
+    def rebuild(self):
+        """Update the output file. Return True if it was written."""
+        self.parsed = 0
+        self.formatted = 0
+        sort_dict = self.parse()
+
+        def render(ref):
+            return format_reference(ref, self.faname)
+
+        sections = {}
+        for entrytype, heading in SECTIONS:
+            if entrytype not in sort_dict:
+                continue
+            refs = sort_dict[entrytype]
+            # Unchanged records give the same entry objects, so the
+            # section only has to be formatted again if any of its
+            # references is a different object.
+            previous = self.sections.get(entrytype)
+            if (previous is not None and len(previous[0]) == len(refs) and
+                    all(a is b for a, b in zip(previous[0], refs))):
+                sections[entrytype] = previous
+            else:
+                sections[entrytype] = (refs, format_section(heading, refs, render))
+                self.formatted += 1
+        self.sections = sections
+
+        output = '\n'.join(sections[entrytype][1] for entrytype, heading in SECTIONS
+                           if entrytype in sections)
+        if output == self.output and os.path.exists(self.output_file_name):
+            return False
+
+        self.output = output
+        return write_output(self.output_file_name, [output])
+
+
+def watch(bib_file_name, output_file_name, faname=None, parser="bibtexparser",
+          interval=0.5):
+    """Rebuild the output file every time the BibTeX file changes.
+
+    Runs until interrupted with Ctrl-C. A rebuild that fails, for
+    example because the BibTeX file is being replaced or is only half
+    written, is reported, and the file is watched for the next change.
+    """
+    watcher = Watcher(bib_file_name, output_file_name, faname, parser)
+    try:
+        while True:
+            # Start watching before the rebuild, so that a change saved
+            # during the rebuild starts the next one.
+            monitor = ChangeMonitor(bib_file_name, interval)
+            try:
+                start = time.perf_counter()
+                try:
+                    if watcher.rebuild():
+                        sys.stderr.write(
+                            'Wrote {} in {:.3f} s ({} records parsed, {} sections '
+                            'formatted)\n'.format(output_file_name,
+                                                  time.perf_counter() - start,
+                                                  watcher.parsed, watcher.formatted))
+                except Exception as e:
+                    sys.stderr.write('Could not rebuild {}: {!r}\n'.format(output_file_name, e))
+                monitor.wait()
+            finally:
+                monitor.close()
+    except KeyboardInterrupt:
+        pass
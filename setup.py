@@ -53,9 +53,11 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 
     # What does your project relate to?
@@ -75,6 +77,10 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=['bibtexparser'],
 
+    # The server needs `asyncio.get_running_loop`, and the order of the
+    # references relies on dictionaries keeping their insertion order.
+    python_requires='>=3.7',
+
     tests_require=['pytest', 'pytest-cov'],
 
     # List additional groups of dependencies here (e.g. development
@@ -0,0 +1,32 @@
+"""
+Fixtures shared by the testing modules
+"""
+import io
+import pytest
+from bibtextomd.bib import write_references, format_reference
+
+
+@pytest.fixture
+def bib_text():
+    """The BibTeX of the `bib` file, tests/refs.bib unless a module overrides it."""
+    with open('tests/refs.bib', 'r', encoding='utf-8') as refs:
+        return refs.read()
+
+
+@pytest.fixture
+def bib(tmpdir, bib_text):
+    """A BibTeX file with `bib_text` in a temporary directory."""
+    bib = tmpdir.join('refs.bib')
+    # Written as bytes, so the line endings are kept as they are.
+    bib.write_binary(bib_text.encode('utf-8'))
+    return bib
+
+
+@pytest.fixture
+def formatted():
+    """Return a function that writes sorted references without any highlighting."""
+    def formatted(sort_dict):
+        out_file = io.StringIO()
+        write_references(out_file, sort_dict, lambda ref: format_reference(ref, None))
+        return out_file.getvalue()
+    return formatted
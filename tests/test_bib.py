@@ -1,9 +1,20 @@
 """
 Testing module for bib.py
 """
+import io
+import json
 import os
+import pickle
+import subprocess
+import sys
 import pytest
-from bibtextomd.bib import main, reorder, load_bibtex, journal_article, in_proceedings, thesis
+from bibtextomd.bib import (main, render, reorder, load_bibtex, iter_bibtex, journal_article,
+                            in_proceedings, thesis, month_number, sort_references,
+                            format_references, tidy_name, Segment, FORMATTERS, SECTIONS,
+                            register_entry_type, write_references, write_output, shard_references,
+                            Reference, check_reference, BOOK_TEMPLATE, InvalidReferenceError,
+                            stream_bibtex)
+from bibtexparser.customization import convert_to_unicode
 
 
 def test_single_author_good():
@@ -42,6 +53,22 @@ def test_and_in_name():
     assert n == 'B.W. Cooler'
 
 
+def test_and_at_end_of_name():
+    names = 'Doe, Ferdinand Jane and\nRand, Ayn'
+    n = reorder(names, None)
+    assert n == 'F.J. Doe and A. Rand'
+
+
+def test_name_memo():
+    tidy_name.cache_clear()
+    names = 'Author, First A. and Name, Second N. and Author, First A.'
+    reorder(names, None)
+    reorder(names, None)
+    info = tidy_name.cache_info()
+    assert info.misses == 2
+    assert info.hits == 4
+
+
 def test_no_highlighted_name():
     names = 'Author, First A.'
     n = reorder(names, None)
@@ -160,5 +187,704 @@ def test_main():
     main(args)
     with open('tests/pubs.md', 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
         assert pubs.read() == blessed.read()
-    if os.path.exists('tests/pubs.md'):
-        os.remove('tests/pubs.md')
+    for name in ('tests/pubs.md', 'tests/.pubs.md.cache'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def test_write_output(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    assert write_output(output, ['Journal Articles\n', '---\n', 'Caf\u00e9\n'])
+    with open(output, 'rb') as pubs:
+        assert pubs.read() == 'Journal Articles\n---\nCaf\u00e9\n'.encode('utf-8')
+    os.chmod(output, 0o640)
+    inode = os.stat(output).st_ino
+    assert not write_output(output, ['Journal Articles\n---\nCaf\u00e9\n'])
+    assert os.stat(output).st_ino == inode
+    assert write_output(output, ['Other\n'])
+    assert os.stat(output).st_mode & 0o777 == 0o640
+    assert tmpdir.listdir() == [tmpdir.join('pubs.md')]
+
+
+def test_write_output_syncs_before_replacing(tmpdir, monkeypatch):
+    calls = []
+    fsync, replace = os.fsync, os.replace
+
+    def sync(fd):
+        calls.append('fsync')
+        fsync(fd)
+
+    def rename(src, dst):
+        calls.append('replace')
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'fsync', sync)
+    monkeypatch.setattr(os, 'replace', rename)
+    assert write_output(str(tmpdir.join('pubs.md')), ['Journal Articles\n'])
+    assert calls == ['fsync', 'replace']
+
+
+def test_shard_by_type(tmpdir):
+    output = tmpdir.join('pubs.md')
+    main(['-b', 'tests/refs.bib', '-o', str(output), '--shard', 'type'])
+    names = ['article', 'inproceedings', 'phdthesis', 'mastersthesis']
+    assert output.read() == ''.join('- [{}](pubs-{}.md)\n'.format(heading, name)
+                                    for name, heading in zip(names, [
+                                        'Journal Articles',
+                                        'Conference Publications and Posters',
+                                        'Ph.D. Dissertation', "Master's Thesis"]))
+    shards = '\n'.join(tmpdir.join('pubs-{}.md'.format(name)).read() for name in names)
+    with open('tests/pubs_blessed.md', 'r') as blessed:
+        assert shards == blessed.read()
+
+
+def test_shard_by_year_only_writes_changed_shards(tmpdir):
+    bib = tmpdir.join('refs.bib')
+    with open('tests/refs.bib', 'r') as refs:
+        bib.write(refs.read())
+    output = tmpdir.join('pubs.md')
+    args = ['-b', str(bib), '-o', str(output), '--shard', 'year']
+    main(args)
+    assert output.read() == ''.join('- [{0}](pubs-{0}.md)\n'.format(year)
+                                    for year in ['2016', '2014', '2013', '2011', '2010'])
+    assert tmpdir.join('pubs-2013.md').read().count('{:.paper}') == 3
+    before = dict((year, tmpdir.join('pubs-{}.md'.format(year)).stat().mtime_ns)
+                  for year in ['2016', '2011'])
+
+    # Move the 2016 paper to 2015
+    bib.write(bib.read().replace('2016', '2015'))
+    main(args)
+    assert not tmpdir.join('pubs-2016.md').exists()
+    assert '### 2015' in tmpdir.join('pubs-2015.md').read()
+    assert tmpdir.join('pubs-2011.md').stat().mtime_ns == before['2011']
+
+
+@pytest.mark.parametrize('cache', [[], ['--no-cache']])
+def test_shard_removes_old_shards(tmpdir, cache):
+    output = tmpdir.join('pubs.md')
+    main(['-b', 'tests/refs.bib', '-o', str(output), '--shard', 'year'] + cache)
+    assert tmpdir.join('pubs-2016.md').exists()
+    # Left over from a run that was not cached, or from another file
+    tmpdir.join('pubs-1999.md').write('')
+    tmpdir.join('pubs-notes.md').write('')
+    main(['-b', 'tests/refs.bib', '-o', str(output), '--shard', 'type'] + cache)
+    assert not tmpdir.join('pubs-2016.md').exists()
+    assert not tmpdir.join('pubs-1999.md').exists()
+    assert tmpdir.join('pubs-article.md').exists()
+    assert tmpdir.join('pubs-notes.md').exists()
+
+
+def test_shard_by_type_and_year(load_bibtex_for_test):
+    shards = shard_references(load_bibtex_for_test, 'type-year')
+    assert [(name, group, title) for name, group, title, shard in shards][:3] == [
+        ('article-2013', 'Journal Articles', '2013'),
+        ('article-2011', 'Journal Articles', '2011'),
+        ('inproceedings-2016', 'Conference Publications and Posters', '2016'),
+        ]
+    assert len(shards[0][3]['article']) == 2
+
+
+@pytest.mark.parametrize('source', ['stream', 'string', 'entries', 'sort_dict'])
+def test_render(source):
+    with open('tests/refs.bib', 'r', encoding='utf-8') as bib_file:
+        if source == 'stream':
+            chunks = list(render(bib_file))
+        elif source == 'string':
+            chunks = list(render(bib_file.read()))
+        elif source == 'entries':
+            chunks = list(render(list(iter_bibtex(bib_file))))
+        else:
+            chunks = list(render(load_bibtex('tests/refs.bib')))
+    assert len(chunks) > 7
+    with open('tests/pubs_blessed.md', 'r') as blessed:
+        assert ''.join(chunks) == blessed.read()
+
+
+def test_render_author_and_sections(load_bibtex_for_test):
+    output = ''.join(render(load_bibtex_for_test, author='S.B. Second',
+                            sections=['inproceedings', ('phdthesis', 'Dissertation')]))
+    assert output.startswith('Conference Publications and Posters\n---\n')
+    assert '**S.B. Second**' in output
+    assert '\nDissertation\n---\n' in output
+    assert 'Journal Articles' not in output
+
+
+def test_author_index(load_bibtex_for_test):
+    index = load_bibtex_for_test.author_index
+    assert index['F.A. Author'] == ['Author2013', 'Author2013a', 'Author2011', 'Second2013',
+                                    'Second2016', 'Author2010', 'Author2014']
+    assert index['S.B. Second'] == ['Second2013', 'Second2016']
+    assert load_bibtex_for_test.ids_of('N.O. One') == frozenset()
+
+
+def test_by_author(load_bibtex_for_test):
+    refs = load_bibtex_for_test.by_author('S.B. Second')
+    assert list(refs) == ['inproceedings']
+    assert [ref['ID'] for ref in refs['inproceedings']] == ['Second2016', 'Second2013']
+    assert sorted(refs.author_index) == ['F.A. Author', 'S. Fourth-Fifth', 'S.B. Second',
+                                         'T.C. Third']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_main_only_author(tmpdir, stream):
+    output = tmpdir.join('pubs.md')
+    args = ['-b', 'tests/refs.bib', '-o', str(output), '-a', 'S.B. Second',
+            '--only-author', 'S.B. Second'] + (['--stream'] if stream else [])
+    main(args)
+    pubs = output.read()
+    assert pubs.startswith('Conference Publications and Posters\n---\n')
+    assert pubs.count('{:.paper}') == 2
+    assert pubs.count('**S.B. Second**') == 2
+
+
+def test_main_warns_once_for_missing_author(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    with pytest.warns(UserWarning) as record:
+        main(['-b', 'tests/refs.bib', '-o', output, '-a', 'N.O. One'])
+    assert len(record) == 1
+    with pytest.warns(UserWarning) as record:
+        main(['-b', 'tests/refs.bib', '-o', output, '-a', 'N.O. One', '--stream',
+              '--no-cache'])
+    assert len(record) == 1
+    with open(output, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
+
+
+def test_formats(tmpdir):
+    output = tmpdir.join('pubs.md')
+    main(['-b', 'tests/refs.bib', '-o', str(output), '-a', 'S.B. Second',
+          '--format', 'kramdown', 'markdown', 'html', 'jsonl'])
+    main(['-b', 'tests/refs.bib', '-o', str(tmpdir.join('expected.md')), '-a', 'S.B. Second'])
+    assert output.read() == tmpdir.join('expected.md').read()
+
+    markdown = tmpdir.join('pubs.markdown').read()
+    assert markdown.startswith('Journal Articles\n---\n\n### 2013\n\nA study of the best')
+    assert '{:.' not in markdown and '<span>' not in markdown
+
+    html = tmpdir.join('pubs.html').read()
+    assert html.startswith('<h2>Journal Articles</h2>\n<h3 class="year">2013</h3>\n'
+                           '<div class="paper">\n')
+    assert '<em>Journal Of Made Up Names &amp; Words</em>' in html
+    assert '<a href="https://dx.doi.org/10.0000/made-up-doi">10.0000/made-up-doi</a>' in html
+    assert '<span class="authors"><strong>S.B. Second</strong>, T.C. Third' in html
+    assert '<h2>Master&#x27;s Thesis</h2>' in html
+
+    lines = [json.loads(line) for line in tmpdir.join('pubs.jsonl').read().splitlines()]
+    assert [ref['ID'] for ref in lines] == ['Author2013', 'Author2013a', 'Author2011',
+                                            'Second2016', 'Second2013', 'Author2014',
+                                            'Author2010']
+    assert lines[0]['authors'] == ['F.A. Author', 'S.B. Sécond', 'T.C. Third']
+
+
+def test_stream_one_format_only():
+    with pytest.raises(SystemExit):
+        main(['--stream', '--format', 'kramdown', 'html'])
+
+
+OTHER_BIB = """@article{Author2011b,
+author = {Author, F.},
+journal = {Journal of Made Up Names},
+month = may,
+title = {A Follow-Up Study on Made Up Names.},
+year = {2011},
+}
+@inproceedings{Second2016x,
+author = {Second, S. B.},
+booktitle = {5th International Conference on BibTeX},
+month = jun,
+title = {How to cite media},
+year = {2016},
+doi = {https://doi.org/10.1000/CONFERENCE-DOI}
+}
+@mastersthesis{Author2010,
+author = {Author, First A.},
+school = {University},
+month = may,
+title = {Another thesis},
+year = {2010},
+}
+"""
+
+NEW_BIB = """@article{New2017,
+author = {New, Brand},
+journal = {Journal of Made Up Names},
+month = jan,
+title = {A new study},
+year = {2017},
+}
+"""
+
+
+def test_merge_bibfiles(tmpdir, capsys):
+    with open('tests/refs.bib', encoding='utf-8') as f:
+        refs = f.read()
+    tmpdir.join('a.bib').write_text(refs, encoding='utf-8')
+    tmpdir.join('b.bib').write_text(OTHER_BIB + NEW_BIB, encoding='utf-8')
+    tmpdir.join('merged.bib').write_text(refs + NEW_BIB, encoding='utf-8')
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', str(tmpdir.join('[ab].bib')), '-o', output, '-j', '2'])
+    report = capsys.readouterr().err
+    assert 'Merged 3 duplicate references' in report
+    assert 'Author2011b ({}) into Author2011 ({}): same title'.format(
+        tmpdir.join('b.bib'), tmpdir.join('a.bib')) in report
+    assert 'Second2016x' in report and 'into Second2016' in report and 'same DOI' in report
+    assert 'same ID' in report
+
+    expected = str(tmpdir.join('expected.md'))
+    main(['-b', str(tmpdir.join('merged.bib')), '-o', expected])
+    with open(output) as out, open(expected) as exp:
+        assert out.read() == exp.read()
+
+
+def test_no_bibfile_matches(tmpdir):
+    with pytest.raises(SystemExit):
+        main(['-b', str(tmpdir.join('*.bib')), '-o', str(tmpdir.join('pubs.md'))])
+
+
+@pytest.mark.parametrize('mode', [['--watch'], ['--serve'], ['--manifest', 'jobs.json']])
+@pytest.mark.parametrize('option', [['--format', 'html'], ['--strict'], ['--since', '2013'],
+                                    ['--limit', '1'], ['--shard', 'year'],
+                                    ['--only-author', 'S.B. Second'], ['--stream'],
+                                    ['--snapshot'], ['--parse-jobs', '2']])
+def test_options_not_used_by_mode(mode, option, capsys):
+    with pytest.raises(SystemExit):
+        main(['-b', 'tests/refs.bib'] + mode + option)
+    assert '{} cannot be used with {}'.format(option[0], mode[0]) in capsys.readouterr().err
+
+
+def test_render_html(load_bibtex_for_test):
+    output = ''.join(render(load_bibtex_for_test, sections=['phdthesis'],
+                            output_format='html'))
+    assert output == ('<h2>Ph.D. Dissertation</h2>\n'
+                      '<h3 class="year">2014</h3>\n'
+                      '<div class="paper">\n'
+                      '<span class="papertitle">The worst sources of name generation</span><br>\n'
+                      '<span class="authors">F.A. Author</span><br>\n'
+                      '<span class="journal">College, Aug. 2014</span><br>\n'
+                      '<span class="comment">Files at the following link</span><br>\n'
+                      '</div>\n')
+
+
+def test_iter_bibtex():
+    with open('tests/refs.bib', 'r', encoding='utf-8') as bib_file:
+        ids = [ref['ID'] for ref in iter_bibtex(bib_file)]
+    assert ids == ['Author2013', 'Author2013a', 'Author2011', 'Second2013', 'Second2016',
+                   'Author2010', 'Author2014']
+
+
+def test_iter_bibtex_bytes_and_strings():
+    bib = (
+        b'@string{jmun = "Journal of Made Up Names"}\n'
+        b'@article{Key2015,\n'
+        b'author = {S\\\'{e}cond, Second B.},\n'
+        b'journal = jmun,\n'
+        b'month = jan,\n'
+        b'year = {2015},\n'
+        b'}\n'
+        )
+    refs = list(iter_bibtex(io.BytesIO(bib)))
+    assert len(refs) == 1
+    assert refs[0]['journal'] == 'Journal of Made Up Names'
+    assert refs[0]['author'] == 'Sécond, Second B.'
+
+
+def test_main_stream():
+    args = '-b tests/refs.bib -o tests/pubs_stream.md --stream'.split()
+    main(args)
+    with open('tests/pubs_stream.md', 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
+    for name in ('tests/pubs_stream.md', 'tests/.pubs_stream.md.cache'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+@pytest.mark.parametrize('month', ['aug', 'Aug', 'AUG', 'August', 'august', 'Aug.', '8', '08'])
+def test_month_number(month):
+    assert month_number(month) == 8
+
+
+def test_bad_month():
+    with pytest.raises(ValueError):
+        month_number('Augtober')
+
+
+def test_sort_references():
+    refsdict = {
+        'A': {'ID': 'A', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'may'},
+        'B': {'ID': 'B', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'December'},
+        'C': {'ID': 'C', 'ENTRYTYPE': 'article', 'year': '2014', 'month': '1'},
+        'D': {'ID': 'D', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'may'},
+        'E': {'ID': 'E', 'ENTRYTYPE': 'phdthesis', 'year': '2010', 'month': 'jun'},
+    }
+    sort_dict = sort_references(refsdict)
+    assert [ref['ID'] for ref in sort_dict['article']] == ['C', 'B', 'A', 'D']
+    assert [ref['ID'] for ref in sort_dict['phdthesis']] == ['E']
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 5])
+def test_sort_references_limit(limit):
+    refsdict = {
+        'A': {'ID': 'A', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'may'},
+        'B': {'ID': 'B', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'December'},
+        'C': {'ID': 'C', 'ENTRYTYPE': 'article', 'year': '2014', 'month': '1'},
+        'D': {'ID': 'D', 'ENTRYTYPE': 'article', 'year': '2013', 'month': 'may'},
+        'E': {'ID': 'E', 'ENTRYTYPE': 'phdthesis', 'year': '2010', 'month': 'jun'},
+    }
+    sort_dict = sort_references(refsdict, limit)
+    assert [ref['ID'] for ref in sort_dict['article']] == ['C', 'B', 'A', 'D'][:limit]
+    assert [ref['ID'] for ref in sort_dict['phdthesis']] == ['E']
+
+
+@pytest.mark.parametrize('options', [[], ['--stream'], ['--snapshot'],
+                                     ['--only-author', 'F.A. Author']])
+def test_main_limit_since(tmpdir, options):
+    bib_file_name = str(tmpdir.join('refs.bib'))
+    with open('tests/refs.bib', encoding='utf-8') as f:
+        tmpdir.join('refs.bib').write_text(f.read(), encoding='utf-8')
+    output = tmpdir.join('pubs.md')
+    main(['-b', bib_file_name, '-o', str(output), '--limit', '1', '--since', '2013'] + options)
+    pubs = output.read()
+    assert pubs.count('{:.paper}') == 3
+    assert 'A study of the best ways to make up a name</span>' in pubs
+    assert '5th International Conference on BibTeX' in pubs
+    assert 'The worst sources of name generation' in pubs
+    assert 'The best sources of name generation' not in pubs
+
+
+def limit_bib(records):
+    return ''.join('@article{{{0},\nauthor = {{Author, First A.}},\njournal = {{Journal}},\n'
+                   'title = {{Title {0}}},\nyear = {{{1}}},\n}}\n'.format(ID, year)
+                   for ID, year in records)
+
+
+@pytest.mark.parametrize('records, limit, expected_formatted', [
+    # Newest first, only the first 3 can be kept
+    ([('Key{}'.format(i), year) for i, year in enumerate(range(2020, 2000, -1))], 3,
+     ['Key0', 'Key1', 'Key2']),
+    ([('Key{}'.format(i), year)
+      for i, year in enumerate([2010, 2014, 2012, 2016, 2016, 2011, 2015, 2013])], 3,
+     ['Key0', 'Key1', 'Key2', 'Key3', 'Key4', 'Key6']),
+    # The later A replaces the earlier one, so B, which was skipped,
+    # is the newest after all
+    ([('A', 2016), ('B', 2015), ('A', 2010)], 1, ['A', 'A', 'B', 'A']),
+])
+def test_stream_limit_formats_only_newest(tmpdir, monkeypatch, records, limit,
+                                          expected_formatted):
+    bib = tmpdir.join('refs.bib')
+    bib.write(limit_bib(records))
+    expected = load_bibtex(str(bib), limit=limit)
+    formatted = []
+
+    def counted(ref, faname, *args, **kwargs):
+        formatted.append(ref["ID"])
+        return 'Formatted'
+
+    monkeypatch.setattr('bibtextomd.bib.format_reference', counted)
+    sort_dict = stream_bibtex(str(bib), None, limit=limit)
+    assert ([(ref["ID"], ref["year"]) for ref in sort_dict['article']] ==
+            [(ref["ID"], ref["year"]) for ref in expected['article']])
+    assert formatted == expected_formatted
+
+
+def test_format_references_parallel(load_bibtex_for_test):
+    refs = [ref for t in ('article', 'inproceedings', 'phdthesis', 'mastersthesis')
+            for ref in load_bibtex_for_test[t]]
+    serial = format_references(refs, 'F.A. Author')
+    assert format_references(refs, 'F.A. Author', jobs=2) == serial
+    assert serial[0] == journal_article(refs[0], 'F.A. Author')
+
+
+@pytest.mark.parametrize('stream', [[], ['--stream']])
+def test_main_jobs(tmpdir, stream):
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', 'tests/refs.bib', '-o', output, '--jobs', '2'] + stream)
+    with open(output, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+def test_batch(tmpdir, monkeypatch):
+    import bibtextomd.bib
+    bib_file_name = os.path.abspath('tests/refs.bib')
+    manifest = [
+        {'bibfile': bib_file_name, 'output': 'plain.md'},
+        {'bibfile': bib_file_name, 'output': 'author.md', 'author': 'F.A. Author'},
+        {'bibfile': bib_file_name, 'output': 'second.md', 'author': 'S.B. Second'},
+    ]
+    tmpdir.join('manifest.json').write(json.dumps(manifest))
+
+    loaded = []
+
+    def counting_load_bibtex(bib_file_name, stats=None):
+        loaded.append(bib_file_name)
+        return load_bibtex(bib_file_name, stats)
+
+    monkeypatch.setattr(bibtextomd.bib, 'load_bibtex', counting_load_bibtex)
+    main(['--manifest', str(tmpdir.join('manifest.json'))])
+    assert loaded == [bib_file_name]
+    monkeypatch.undo()
+
+    with open('tests/pubs_blessed.md', 'r') as blessed:
+        assert tmpdir.join('plain.md').read() == blessed.read()
+
+    for output, author in (('author.md', 'F.A. Author'), ('second.md', 'S.B. Second')):
+        expected = str(tmpdir.join('expected.md'))
+        main(['-b', 'tests/refs.bib', '-o', expected, '-a', author, '--no-cache'])
+        assert tmpdir.join(output).read() == tmpdir.join('expected.md').read()
+
+
+def test_techreport():
+    ref = {
+        'ID': 'Author2012', 'ENTRYTYPE': 'techreport', 'author': 'Author, First A.',
+        'title': 'A report on names', 'institution': 'University', 'number': '12-3',
+        'year': '2012',
+    }
+    reference = FORMATTERS['techreport'](ref, None)
+    reference_blessed = (
+        "\n{:.paper}\n"
+        "<span>A report on names</span>{:.papertitle}  \n"
+        "<span>F.A. Author</span>{:.authors}  \n"
+        "<span>University, Report No. 12-3, 2012</span>{:.journal}  \n"
+        )
+    assert reference == reference_blessed
+
+
+def test_missing_required_field():
+    ref = {'ID': 'Key', 'ENTRYTYPE': 'article', 'author': 'Author, First A.', 'year': '2012',
+           'month': 'jan', 'journal': 'Journal'}
+    with pytest.raises(KeyError):
+        journal_article(ref, None)
+
+
+INVALID_BIB = """@article{NoYear,
+author = {Author, First A.},
+journal = {Journal},
+title = {No year},
+}
+@article{BadMonth,
+author = {Author, First A.},
+journal = {Journal},
+month = {Smarch},
+title = {Bad month},
+year = {2015},
+}
+@article{NoJournal,
+author = {Author, First A.},
+title = {No journal},
+year = {2015},
+}
+@article{NoMonth,
+author = {Author, First A.},
+journal = {Journal},
+title = {No month},
+year = {2015},
+}
+@article{BadAuthor,
+author = {Author, First A. and John Smith},
+journal = {Journal},
+title = {Bad author},
+year = {2015},
+}
+@online{NoDate,
+title = {A web page},
+}
+"""
+
+
+def test_check_reference():
+    ref = {'ID': 'Key', 'ENTRYTYPE': 'article', 'title': 'Title', 'month': 'Smarch'}
+    assert check_reference(ref) == ["missing year", "unknown month 'Smarch'",
+                                    "missing author", "missing journal"]
+    assert check_reference({'ID': 'Key', 'ENTRYTYPE': 'unknown'}) == []
+    # Types without a section are not written, so they are not checked
+    assert check_reference({'ID': 'Key', 'ENTRYTYPE': 'misc'}) == []
+    assert check_reference({'ID': 'Key', 'ENTRYTYPE': 'misc'}, ['misc']) == [
+        "missing year", "missing title"]
+    ref = {'ID': 'Key', 'ENTRYTYPE': 'article', 'title': 'Title', 'journal': 'Journal',
+           'year': '2012', 'author': 'Author, First A. and Last,'}
+    assert check_reference(ref) == ["badly formed author 'Last,', expected 'Last, First'"]
+
+
+@pytest.mark.parametrize('stream', [[], ['--stream']])
+def test_main_invalid_references(tmpdir, stream):
+    bib_file_name = str(tmpdir.join('refs.bib'))
+    with open('tests/refs.bib', encoding='utf-8') as f:
+        tmpdir.join('refs.bib').write_text(f.read() + INVALID_BIB, encoding='utf-8')
+    output = tmpdir.join('pubs.md')
+    with pytest.warns(UserWarning) as record:
+        main(['-b', bib_file_name, '-o', str(output)] + stream)
+    assert len(record) == 1
+    message = str(record[0].message)
+    assert message.startswith('Skipped 4 invalid references:\n')
+    assert '{}: NoYear: missing year\n'.format(bib_file_name) in message
+    assert "BadMonth: unknown month 'Smarch'\n" in message
+    assert 'NoJournal: missing journal\n' in message
+    assert "BadAuthor: badly formed author 'John Smith'" in message
+    assert 'NoDate' not in message
+    pubs = output.read()
+    assert pubs.count('{:.paper}') == 8
+    assert '<span>_Journal_, 2015</span>' in pubs
+
+    # The output is up to date, but the invalid references are still
+    # reported.
+    with pytest.warns(UserWarning, match='Skipped 4 invalid references'):
+        main(['-b', bib_file_name, '-o', str(output)] + stream)
+    with pytest.raises(SystemExit) as e:
+        main(['-b', bib_file_name, '-o', str(output), '--strict'] + stream)
+    assert e.value.code == 1
+
+    output.remove()
+    with pytest.raises(SystemExit) as e:
+        main(['-b', bib_file_name, '-o', str(output), '--strict'] + stream)
+    assert e.value.code == 1
+    assert not output.exists()
+
+
+BOOK_BIB = """
+@book{Book2010,
+author = {Author, First A.},
+title = {{A Book of Names}},
+publisher = {Publisher},
+year = {2010},
+}
+"""
+
+
+def test_render_invalid_references(load_bibtex_for_test):
+    with open('tests/refs.bib', encoding='utf-8') as f:
+        bib = f.read()
+    with pytest.warns(UserWarning, match='Skipped 4 invalid references') as record:
+        output = ''.join(render(bib + INVALID_BIB))
+    assert '<string>: NoYear: missing year' in str(record[0].message)
+    # Only the reference without a month is valid
+    assert output.count('{:.paper}') == 8
+    with pytest.raises(InvalidReferenceError):
+        list(render(bib + INVALID_BIB, strict=True))
+
+    # The references of a section that `load_bibtex` did not check
+    sort_dict = dict(load_bibtex_for_test)
+    sort_dict['misc'] = [{'ID': 'Misc', 'ENTRYTYPE': 'misc', 'title': 'A misc'}]
+    with pytest.warns(UserWarning, match='Misc: missing year'):
+        output = ''.join(render(sort_dict, sections=['article', ('misc', 'Other')]))
+    assert 'Other' not in output
+
+
+def test_book_section_is_opt_in(monkeypatch):
+    assert ''.join(render(BOOK_BIB)) == ''
+    monkeypatch.setattr('bibtextomd.bib.SECTIONS', list(SECTIONS))
+    register_entry_type('book', BOOK_TEMPLATE, 'Books')
+    assert ''.join(render(BOOK_BIB)).startswith("Books\n---\n")
+
+
+@pytest.mark.parametrize('shard', [[], ['--shard', 'type']])
+def test_new_section_is_written(tmpdir, monkeypatch, shard):
+    bib_file_name = str(tmpdir.join('refs.bib'))
+    with open('tests/refs.bib', encoding='utf-8') as f:
+        tmpdir.join('refs.bib').write_text(f.read() + BOOK_BIB, encoding='utf-8')
+    output = tmpdir.join('pubs.md')
+    args = ['-b', bib_file_name, '-o', str(output)] + shard
+    main(args)
+    assert 'Books' not in output.read()
+    monkeypatch.setattr('bibtextomd.bib.SECTIONS', list(SECTIONS))
+    register_entry_type('book', BOOK_TEMPLATE, 'Books')
+    main(args)
+    if shard:
+        assert 'Books' in output.read()
+        output = tmpdir.join('pubs-book.md')
+    assert 'A Book of Names' in output.read()
+
+
+def test_register_entry_type(monkeypatch):
+    monkeypatch.setattr('bibtextomd.bib.SECTIONS', list(SECTIONS))
+    monkeypatch.setitem(FORMATTERS, 'patent', None)
+    render = register_entry_type('patent', [
+        ('papertitle', [Segment('title', required=True)]),
+        ('journal', [Segment('number', 'Patent {value}'), Segment('date', required=True)]),
+    ], 'Patents')
+    ref = {'ID': 'Key', 'ENTRYTYPE': 'patent', 'title': 'A name machine', 'number': '1234',
+           'month': 'may', 'year': '2015'}
+    out_file = io.StringIO()
+    write_references(out_file, {'patent': [ref]}, lambda ref: render(ref, None))
+    assert out_file.getvalue() == (
+        "Patents\n---\n"
+        "\n{:.year}\n### 2015\n"
+        "\n{:.paper}\n"
+        "<span>A name machine</span>{:.papertitle}  \n"
+        "<span>Patent 1234, May 2015</span>{:.journal}  \n"
+        )
+
+
+def test_write_references_headings_once(load_bibtex_for_test):
+    sort_dict = {'phdthesis': load_bibtex_for_test['phdthesis'] * 2}
+    out_file = io.StringIO()
+    write_references(out_file, sort_dict, lambda ref: thesis(ref, None))
+    assert out_file.getvalue().count('Ph.D. Dissertation') == 1
+    assert out_file.getvalue().count('### 2014') == 1
+
+
+def test_reference_matches_convert_to_unicode():
+    with open('tests/refs.bib', 'r', encoding='utf-8') as bib_file:
+        for ref in iter_bibtex(bib_file):
+            assert isinstance(ref, Reference)
+            assert dict(ref) == convert_to_unicode(dict(ref.raw))
+
+
+def test_reference_decodes_used_fields():
+    ref = Reference({'ID': 'Key', 'author': "S\\'{e}cond, Second B.", 'abstract': 'An \\"{a}',
+                     'year': '2015'})
+    assert ref['author'] == 'Sécond, Second B.'
+    assert ref['year'] == '2015'
+    assert 'abstract' in ref
+    assert sorted(ref.decoded) == ['author']
+    assert ref.raw['author'] == "S\\'{e}cond, Second B."
+
+
+def test_reference_slots():
+    ref = Reference({'ID': 'Key', 'ENTRYTYPE': 'article', 'month': 'may', 'year': '2015',
+                     'abstract': 'Text'})
+    assert not hasattr(ref, '__dict__')
+    assert ref.extra == {'abstract': 'Text'}
+    assert 'title' not in ref
+    with pytest.raises(KeyError):
+        ref['title']
+    assert list(ref) == ['ID', 'ENTRYTYPE', 'month', 'year', 'abstract']
+    assert len(ref) == 5
+    other = Reference({'month': ''.join(['m', 'ay'])})
+    assert other.month is ref.month
+    assert pickle.loads(pickle.dumps(ref)) == ref
+
+
+def _modules_after(code):
+    """Run `code` in a new interpreter and return the names of the imported modules."""
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'])
+    return output.decode().split()
+
+
+def test_lazy_imports():
+    modules = _modules_after('import bibtextomd.__main__')
+    for module in ('bibtexparser', 'argparse', 'multiprocessing', 'cProfile'):
+        assert module not in modules
+
+
+def test_unchanged_does_not_parse(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    args = ['-b', 'tests/refs.bib', '-o', output]
+    main(args)
+    modules = _modules_after('from bibtextomd.bib import main\nmain({!r})'.format(args))
+    assert 'bibtexparser' not in modules
+
+
+def test_changed_parser_parses_again(tmpdir, monkeypatch):
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', 'tests/refs.bib', '-o', output])
+    loaded = []
+
+    def load(*args, **kwargs):
+        loaded.append(args)
+        return load_bibtex(*args, **kwargs)
+    monkeypatch.setattr('bibtextomd.bib.load_bibtex', load)
+    main(['-b', 'tests/refs.bib', '-o', output])
+    assert not loaded
+    main(['-b', 'tests/refs.bib', '-o', output, '--parser', 'fast'])
+    assert len(loaded) == 1
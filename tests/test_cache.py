@@ -0,0 +1,119 @@
+"""
+Testing module for cache.py
+"""
+import os
+from bibtextomd.bib import main
+from bibtextomd.cache import RenderCache, cache_file_name, entry_key
+
+
+def test_cache_file_name():
+    assert cache_file_name(os.path.join('site', 'pubs.md')) == os.path.join('site',
+                                                                            '.pubs.md.cache')
+    assert cache_file_name('pubs.md') == '.pubs.md.cache'
+
+
+def test_entry_key():
+    ref = {'ID': 'Key', 'ENTRYTYPE': 'article', 'title': 'Title'}
+    key = entry_key(ref, None, 1)
+    assert key == entry_key(dict(ref), None, 1)
+    assert key != entry_key(ref, 'F.A. Author', 1)
+    assert key != entry_key(ref, None, 2)
+    assert key == entry_key(ref, None, 1, 'kramdown')
+    assert key != entry_key(ref, None, 1, 'html')
+    assert key != entry_key(dict(ref, title='Other title'), None, 1)
+
+
+def test_eviction(tmpdir):
+    file_name = str(tmpdir.join('cache'))
+    cache = RenderCache(file_name, max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    cache.set('c', 'C')
+    # Using `b` makes `c` the least recently used after `a`
+    assert cache.get('b') == 'B'
+    cache.save()
+
+    cache = RenderCache(file_name, max_entries=2)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'B'
+    assert cache.get('c') == 'C'
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_main_cache(tmpdir, monkeypatch):
+    output = str(tmpdir.join('pubs.md'))
+    args = ['-b', 'tests/refs.bib', '-o', output]
+    main(args)
+    assert os.path.exists(cache_file_name(output))
+    with open(output, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        blessed = blessed.read()
+        assert pubs.read() == blessed
+
+    # Nothing changed, so the output should not be written again
+    def write_output(*args):
+        raise AssertionError('The output was written again')
+    monkeypatch.setattr('bibtextomd.bib.write_output', write_output)
+    main(args)
+    monkeypatch.undo()
+
+    # The output was changed by hand, so it is written again
+    with open(output, 'w') as pubs:
+        pubs.write('changed')
+    main(args)
+    with open(output, 'r') as pubs:
+        assert pubs.read() == blessed
+
+    # The output was written without the cache, so it is written again
+    main(args + ['-a', 'F.A. Author', '--no-cache'])
+    main(args)
+    with open(output, 'r') as pubs:
+        assert pubs.read() == blessed
+
+    # Clearing the cache formats everything again
+    main(args + ['--clear-cache'])
+    with open(output, 'r') as pubs:
+        assert pubs.read() == blessed
+
+    # A different highlighted author changes every reference
+    main(args + ['-a', 'F.A. Author'])
+    with open(output, 'r') as pubs:
+        assert '**F.A. Author**' in pubs.read()
+
+
+def test_main_cache_other_format(tmpdir):
+    bib = tmpdir.join('refs.bib')
+    with open('tests/refs.bib', 'r') as refs:
+        bib.write(refs.read())
+    output = tmpdir.join('out.md')
+    main(['-b', str(bib), '-o', str(output), '--format', 'html'])
+    assert '<div class="paper">' in output.read()
+    main(['-b', str(bib), '-o', str(output)])
+    with open('tests/pubs_blessed.md', 'r') as blessed:
+        blessed = blessed.read()
+    assert output.read() == blessed
+
+    # The cache holds the references in both formats, and the edited
+    # reference is formatted in the format of the output
+    main(['-b', str(bib), '-o', str(output), '--format', 'html'])
+    bib.write(bib.read().replace('The worst sources', 'The very worst sources'))
+    main(['-b', str(bib), '-o', str(output)])
+    assert output.read() == blessed.replace('The worst sources', 'The very worst sources')
+
+
+def test_main_shard_changed_by_hand(tmpdir):
+    output = tmpdir.join('pubs.md')
+    args = ['-b', 'tests/refs.bib', '-o', str(output), '--shard', 'year']
+    main(args)
+    shard = tmpdir.join('pubs-2016.md')
+    written = shard.read()
+    shard.write('changed')
+    main(args)
+    assert shard.read() == written
+
+
+def test_main_no_cache(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', 'tests/refs.bib', '-o', output, '--no-cache'])
+    assert not os.path.exists(cache_file_name(output))
+    with open(output, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
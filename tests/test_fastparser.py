@@ -0,0 +1,63 @@
+"""
+Testing module for fastparser.py
+"""
+import io
+import pytest
+from bibtextomd.bib import main, iter_bibtex
+from bibtextomd.fastparser import record_parser, BibTeXSyntaxError
+
+
+def parse_both(bib):
+    raw = []
+    for parser in ('bibtexparser', 'fast'):
+        raw.append([ref.raw for ref in iter_bibtex(io.StringIO(bib), parser=parser)])
+    return raw
+
+
+def test_conformance():
+    with open('tests/refs.bib', 'r', encoding='utf-8') as bib_file:
+        bib = bib_file.read()
+    reference, fast = parse_both(bib)
+    assert len(fast) == 7
+    assert fast == reference
+
+
+@pytest.mark.parametrize('bib', [
+    # @string macros, month macros and bare numbers
+    '@string{jmun = "Journal of Made Up Names"}\n'
+    '@article{Key,\nauthor = {Author, First A.},\njournal = jmun,\nmonth = aug,\n'
+    'year = 2015,\n}\n',
+    # Quoted values with braces, and renamed fields
+    '@ARTICLE{Key,\nTitle = "{A {DNA} study}",\nurl = {https://example.com},\n'
+    'Keywords = {a, b},\n}\n',
+    # Values over several lines, and no comma after the last field
+    '@phdthesis{Key,\nabstract = {The first line\n  and the second line},\n'
+    'school = {University}\n}\n',
+    # Comments, preambles, and nonstandard types are skipped
+    '@comment{jabref-meta: databaseType:bibtex;}\n@preamble{"\\newcommand{\\noop}[1]{}"}\n'
+    '@patent{Key,\ntitle = {A patent},\n}\n@misc{Other,\ntitle = {{Misc}},\n}\n',
+])
+def test_conformance_cases(bib):
+    reference, fast = parse_both(bib)
+    assert fast == reference
+
+
+def test_concatenation():
+    parse_record = record_parser()
+    parse_record('@string{jmun = "Made Up Names"}')
+    entries = parse_record('@article{Key,\njournal = "Journal of " # jmun,\n}')
+    assert entries == [{'ENTRYTYPE': 'article', 'ID': 'Key',
+                        'journal': 'Journal of Made Up Names'}]
+
+
+def test_unbalanced_braces():
+    parse_record = record_parser()
+    with pytest.raises(BibTeXSyntaxError):
+        parse_record('@article{Key,\ntitle = {A {study,\n}')
+
+
+def test_main_fast(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', 'tests/refs.bib', '-o', output, '--parser', 'fast'])
+    with open(output, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
@@ -0,0 +1,70 @@
+"""
+Testing module for parallel.py
+"""
+import mmap
+import pytest
+from bibtextomd.bib import load_bibtex, main
+from bibtextomd.parallel import chunk_offsets, parse_parallel
+
+
+def macro_bib():
+    # Entries that use @string macros, which are redefined halfway
+    # through the file, with Windows line endings and a byte-order mark.
+    records = ['\ufeff@string{jnl = {Journal of Made Up Names}}\n']
+    for i in range(60):
+        if i == 30:
+            records.append('@STRING{jnl = "Journal of Other Names"}\n')
+        records.append('@article{Key{i},\n'
+                       'author = {Author, First A. and Name, Second N.},\n'
+                       'journal = jnl,\n'
+                       'month = {month},\n'
+                       'title = {{Title {i}}},\n'
+                       'year = {{{year}}},\n'
+                       '}}\n'.replace('{i}', str(i)).replace(
+                           '{month}', ['jan', 'may', 'aug'][i % 3]).replace(
+                           '{year}', str(2000 + i % 7)))
+    # A duplicate ID, and a comment between the entries
+    records.insert(45, '@comment{Nothing to see here}\n')
+    records.append(records[10])
+    return ''.join(records).replace('\n', '\r\n')
+
+
+@pytest.fixture
+def bib_text():
+    return macro_bib()
+
+
+def test_chunk_offsets(bib):
+    with open(str(bib), 'rb') as bib_file:
+        with mmap.mmap(bib_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = chunk_offsets(mm, 8)
+            assert len(offsets) == 8
+            assert offsets[0][0] == 0 and offsets[-1][1] == len(mm)
+            for (start, end), (next_start, next_end) in zip(offsets, offsets[1:]):
+                assert end == next_start
+                assert mm[next_start:next_start + 1] == b'@'
+
+
+@pytest.mark.parametrize('parser', ['bibtexparser', 'fast'])
+@pytest.mark.parametrize('jobs', [2, 3])
+def test_parallel_is_the_same_as_serial(bib, formatted, parser, jobs):
+    serial = load_bibtex(str(bib), parser=parser)
+    parallel = load_bibtex(str(bib), parser=parser, jobs=jobs)
+    assert list(parallel.references) == list(serial.references)
+    assert ([ref.raw for ref in parallel.references.values()] ==
+            [ref.raw for ref in serial.references.values()])
+    assert parallel.references['Key40']['journal'] == 'Journal of Other Names'
+    assert formatted(parallel) == formatted(serial)
+
+
+def test_parse_empty_file(tmpdir):
+    bib = tmpdir.join('empty.bib')
+    bib.write('')
+    assert parse_parallel(str(bib), 4) == []
+
+
+def test_main_parse_jobs(tmpdir):
+    output = str(tmpdir.join('pubs.md'))
+    main(['-b', 'tests/refs.bib', '-o', output, '--parse-jobs', '2'])
+    with open(output) as out, open('tests/pubs_blessed.md') as blessed:
+        assert out.read() == blessed.read()
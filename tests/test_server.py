@@ -0,0 +1,144 @@
+"""
+Testing module for server.py
+"""
+import asyncio
+import os
+import threading
+from bibtextomd.server import Library, page_names
+
+
+def test_page_is_cached_until_the_file_changes(tmpdir):
+    bib = tmpdir.join('refs.bib')
+    with open('tests/refs.bib', 'r', encoding='utf-8') as refs:
+        bib.write_text(refs.read(), encoding='utf-8')
+    library = Library([str(bib)], max_pages=1)
+
+    with open('tests/pubs_blessed.md', 'r', encoding='utf-8') as blessed:
+        assert library.page('refs').decode('utf-8') == blessed.read()
+    library.page('refs')
+    assert (library.loads, library.hits, library.misses) == (1, 1, 1)
+
+    # Only one page is kept
+    assert b'**F.A. Author**' in library.page('refs', 'F.A. Author')
+    library.page('refs')
+    assert library.misses == 3
+
+    bib.write_text(bib.read_text('utf-8').replace('2016', '2015'), encoding='utf-8')
+    stat = os.stat(str(bib))
+    os.utime(str(bib), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert b'### 2015' in library.page('refs')
+    assert library.loads == 2
+
+
+def test_respond_only_serves_configured_files():
+    library = Library(['tests/refs.bib'])
+    assert library.respond('GET', '/') == (200, 'text/plain; charset=utf-8', b'refs\n')
+    assert library.respond('GET', '/pubs_blessed.md')[0] == 404
+    assert library.respond('GET', '/../setup.py')[0] == 404
+    assert library.respond('POST', '/refs')[0] == 405
+    status, content_type, body = library.respond('GET', '/refs.md?author=S.B.%20Second')
+    assert status == 200
+    assert b'**S.B. Second**' in body
+
+
+def test_handle():
+    library = Library(['tests/refs.bib'])
+
+    async def request():
+        server = await asyncio.start_server(library.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = []
+        for target, connection in (('/refs', 'keep-alive'), ('/missing', 'close')):
+            writer.write('GET {} HTTP/1.1\r\nConnection: {}\r\n\r\n'.format(
+                target, connection).encode())
+            status = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.lower()] = value.strip()
+            body = await reader.readexactly(int(headers['content-length']))
+            responses.append((status, body))
+        # The server closes the connection after the last request
+        assert await reader.read() == b''
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    loop = asyncio.new_event_loop()
+    try:
+        responses = loop.run_until_complete(request())
+    finally:
+        loop.close()
+    assert responses[0][0] == b'HTTP/1.1 200 OK\r\n'
+    assert responses[0][1].startswith(b'Journal Articles\n---\n')
+    assert responses[1][0] == b'HTTP/1.1 404 Not Found\r\n'
+
+
+def test_page_names(tmpdir):
+    assert page_names(['refs.bib', 'other/pubs.bib']) == ['refs', 'pubs']
+    assert page_names([str(tmpdir.join('a', 'refs.bib')),
+                       str(tmpdir.join('b', 'c', 'refs.bib'))]) == ['a/refs', 'b/c/refs']
+
+
+async def get(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def run_server(library, client):
+    async def main():
+        server = await asyncio.start_server(library.handle, '127.0.0.1', 0)
+        try:
+            return await client(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_handle_skips_request_body():
+    library = Library(['tests/refs.bib'])
+
+    async def client(port):
+        return await get(port, b'POST /refs HTTP/1.1\r\nContent-Length: 9\r\n\r\nGET /x 1\n'
+                               b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+
+    response = run_server(library, client)
+    assert response.startswith(b'HTTP/1.1 405 Method Not Allowed\r\n')
+    assert response.count(b'HTTP/1.1 ') == 2
+    assert response.endswith(b'\r\n\r\nrefs\n')
+
+
+def test_slow_page_does_not_block_other_connections(monkeypatch):
+    library = Library(['tests/refs.bib'])
+    release = threading.Event()
+
+    def slow_page(name, author=None):
+        release.wait(5)
+        return b'slow'
+    monkeypatch.setattr(library, 'page', slow_page)
+
+    async def client(port):
+        slow = asyncio.ensure_future(get(port, b'GET /refs HTTP/1.0\r\n\r\n'))
+        await asyncio.sleep(0.05)
+        listing = await get(port, b'GET / HTTP/1.0\r\n\r\n')
+        assert not slow.done()
+        release.set()
+        return listing, await slow
+
+    listing, slow = run_server(library, client)
+    assert listing.endswith(b'\r\n\r\nrefs\n')
+    assert slow.endswith(b'\r\n\r\nslow')
@@ -0,0 +1,42 @@
+"""
+Testing module for snapshot.py
+"""
+import os
+import bibtextomd.bib
+from bibtextomd.bib import load_bibtex
+from bibtextomd.snapshot import read_snapshot, snapshot_file_name
+
+
+def no_parsing(*args, **kwargs):
+    raise AssertionError('The BibTeX file was parsed')
+
+
+def test_snapshot_is_used_while_the_file_does_not_change(bib, formatted, monkeypatch):
+    parsed = load_bibtex(str(bib), snapshot=True)
+    assert os.path.exists(snapshot_file_name(str(bib)))
+
+    monkeypatch.setattr(bibtextomd.bib, 'iter_bibtex', no_parsing)
+    loaded = load_bibtex(str(bib), snapshot=True)
+    assert formatted(loaded) == formatted(parsed)
+    assert loaded.author_index == parsed.author_index
+
+    # Touching the file does not change its hash
+    stat = os.stat(str(bib))
+    os.utime(str(bib), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert read_snapshot(str(bib), 'bibtexparser') is not None
+
+    # A different parser or a broken snapshot needs parsing
+    assert read_snapshot(str(bib), 'fast') is None
+    monkeypatch.undo()
+    with open(snapshot_file_name(str(bib)), 'r+b') as snapshot_file:
+        snapshot_file.truncate(100)
+    assert read_snapshot(str(bib), 'bibtexparser') is None
+
+
+def test_snapshot_is_replaced_when_the_file_changes(bib, formatted):
+    load_bibtex(str(bib), snapshot=True)
+    bib.write_text(bib.read_text('utf-8').replace('2016', '2015'), encoding='utf-8')
+    assert read_snapshot(str(bib), 'bibtexparser') is None
+    refs = load_bibtex(str(bib), snapshot=True)
+    assert '### 2015' in formatted(refs)
+    assert read_snapshot(str(bib), 'bibtexparser') is not None
@@ -0,0 +1,50 @@
+"""
+Testing module for stats.py
+"""
+from bibtextomd.bib import main
+from bibtextomd.stats import Stats, timed_iter
+
+
+def test_stage_and_hooks():
+    stats = Stats()
+    calls = []
+    stats.hooks.append(lambda stage, seconds: calls.append(stage))
+    with stats.stage('sort'):
+        pass
+    stats.add_time('sort', 1.0)
+    assert calls == ['sort', 'sort']
+    assert stats.times['sort'] >= 1.0
+
+
+def test_timed_iter():
+    stats = Stats()
+    assert list(timed_iter(range(3), stats, 'read')) == [0, 1, 2]
+    assert 'read' in stats.times
+
+
+def test_main_stats_hook(tmpdir):
+    stats = Stats()
+    stages = []
+    stats.hooks.append(lambda stage, seconds: stages.append(stage))
+    main(['-b', 'tests/refs.bib', '-o', str(tmpdir.join('pubs.md')), '--no-cache'], stats=stats)
+    for stage in ('read', 'parse', 'sort', 'render', 'write'):
+        assert stage in stages
+    result = stats.as_dict()
+    assert result['entries'] == 7
+    assert result['counts'] == {'article': 3, 'inproceedings': 2, 'mastersthesis': 1,
+                                'phdthesis': 1}
+    assert result['total'] > 0
+
+
+def test_main_stats_report(tmpdir, capsys):
+    main(['-b', 'tests/refs.bib', '-o', str(tmpdir.join('pubs.md')), '--stats', '--stream'])
+    err = capsys.readouterr().err
+    assert 'entries: 7' in err
+    assert 'parse' in err
+
+
+def test_main_profile(tmpdir, capsys):
+    main(['-b', 'tests/refs.bib', '-o', str(tmpdir.join('pubs.md')), '--profile'])
+    err = capsys.readouterr().err
+    assert 'entries: 7' in err
+    assert 'cumulative' in err
@@ -0,0 +1,88 @@
+"""
+Testing module for watch.py
+"""
+import os
+import threading
+from bibtextomd.watch import Watcher, ChangeMonitor, poll_for_change, watch
+
+
+def test_rebuild(tmpdir):
+    bib_file_name = str(tmpdir.join('refs.bib'))
+    output_file_name = str(tmpdir.join('pubs.md'))
+    with open('tests/refs.bib', 'r', encoding='utf-8') as refs:
+        bib = refs.read()
+    with open(bib_file_name, 'w', encoding='utf-8') as refs:
+        refs.write(bib)
+
+    watcher = Watcher(bib_file_name, output_file_name)
+    assert watcher.rebuild()
+    assert watcher.parsed == 7
+    assert watcher.formatted == 4
+    with open(output_file_name, 'r') as pubs, open('tests/pubs_blessed.md', 'r') as blessed:
+        assert pubs.read() == blessed.read()
+
+    # Nothing changed, so nothing is parsed, formatted, or written
+    assert not watcher.rebuild()
+    assert watcher.parsed == 0
+    assert watcher.formatted == 0
+
+    # Changing one article only parses that record and formats the
+    # articles again
+    with open(bib_file_name, 'w', encoding='utf-8') as refs:
+        refs.write(bib.replace('A follow up study', 'A second follow up study'))
+    assert watcher.rebuild()
+    assert watcher.parsed == 1
+    assert watcher.formatted == 1
+    with open(output_file_name, 'r') as pubs:
+        assert 'A second follow up study on made up names' in pubs.read()
+
+
+def test_poll_for_change(tmpdir):
+    file_name = str(tmpdir.join('refs.bib'))
+    with open(file_name, 'w') as refs:
+        refs.write('@article{')
+
+    def change():
+        with open(file_name, 'a') as refs:
+            refs.write('Key,\n}\n')
+
+    timer = threading.Timer(0.1, change)
+    timer.start()
+    poll_for_change(file_name, interval=0.01)
+    timer.join()
+    assert os.path.getsize(file_name) > len('@article{')
+
+
+def test_change_during_rebuild_is_seen(tmpdir):
+    file_name = str(tmpdir.join('refs.bib'))
+    with open(file_name, 'w') as refs:
+        refs.write('@article{')
+    monitor = ChangeMonitor(file_name, interval=0.01)
+    # The file changes before `wait` is called, like during a rebuild
+    with open(file_name, 'a') as refs:
+        refs.write('Key,\n}\n')
+
+    thread = threading.Thread(target=monitor.wait)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_watch_keeps_going_after_errors(tmpdir, monkeypatch, capsys):
+    rebuilds = []
+
+    def rebuild(self):
+        rebuilds.append(None)
+        if len(rebuilds) == 1:
+            raise OSError('The file is being replaced')
+        return False
+
+    def wait(self):
+        if len(rebuilds) == 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(Watcher, 'rebuild', rebuild)
+    monkeypatch.setattr(ChangeMonitor, 'wait', wait)
+    watch(str(tmpdir.join('refs.bib')), str(tmpdir.join('pubs.md')))
+    assert len(rebuilds) == 2
+    assert 'Could not rebuild' in capsys.readouterr().err